@@ -5,9 +5,17 @@ import subprocess
 import time
 import struct
 import argparse
+import os
 import sys
-from ecdsa.keys import VerifyingKey
-from ecdsa.curves import NIST224p
+import threading
+from tagalong.keysearch import is_valid_key
+from tagalong.keycache import KeyCache
+from tagalong import metrics
+from tagalong.metrics import Exporter
+from tagalong.profiling import run_main
+from tagalong.chunking import plan_chunks
+from tagalong.ingest import CsvTail, RowLedger
+from tagalong.txqueue import TransmitQueue, DROP_OLDEST, DOWNSAMPLE
 import pandas as pd
 import numpy as np
 
@@ -33,24 +41,14 @@ def bytes_to_strarray(bytes_, with_prefix=False):
 
 
 def is_valid_pubkey(public_key, valid_key_counter=0):  # Check if the compressed public key is valid
-    temp_pub_key = bytearray(29)
-    temp_pub_key[0] = 0x02
-
     counter_bytes = valid_key_counter.to_bytes(2, 'big')
     public_key[6:8] = counter_bytes
 
-    temp_pub_key[1:] = public_key
-
-    try:
-        VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-    except:
+    if not is_valid_key(public_key):
         return False
-    else:
-        print("valid key!")
-        vk = VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-        pub_key = vk.to_string('uncompressed')
-        print(bytearray.fromhex(public_key.hex()))
-        return True
+    print("valid key!")
+    print(bytearray.fromhex(public_key.hex()))
+    return True
 
 def send_public_key(public_key):
     """Simulate sending the public key."""
@@ -69,6 +67,7 @@ curr_addr = start_addr.copy()
 modem_id = 0xdeadbeef  # Example modem ID
 start_addr = [0] * 16  # Example start address
 curr_addr = start_addr.copy()
+KEY_CACHE_PATH = None  # valid counters persist across runs; None: ~/.cache/tagalong/key_cache.sqlite
 modem_bytearray = bytearray(4)  # Initialize modem_id as a bytearray of 4 bytes
 
 # Convert modem_id to a byte array (little-endian to match memory layout in C)
@@ -78,7 +77,7 @@ modem_id_bytes = modem_id.to_bytes(4, byteorder='little')
 copy_4b_big_endian(modem_bytearray, modem_id_bytes)
 
 
-def set_addr_and_payload_for_byte(index, msg_id, val, chunk_len):
+def set_addr_and_payload_for_body(msg_id, body, key_cache):
     valid_key_counter = 0
     public_key = bytearray(28)
     public_key[0] = 0xBA  # magic value
@@ -88,61 +87,30 @@ def set_addr_and_payload_for_byte(index, msg_id, val, chunk_len):
     # Convert msg to a byte array (big-endian)
     msg_bytes = msg_id.to_bytes(4, byteorder='big')
     public_key[8:12] = msg_bytes
-
-    if index:
-        public_key[12:28] = curr_addr
-    else:
-        public_key[12:28] = start_addr
-
-    bit_index = index * chunk_len
-    byte_index = bit_index // 8
-
-    start_byte = byte_index % 16
-    next_byte = (start_byte + 1) % 16
-
-    start_offset = bit_index % 8
-
-    if (8 - start_offset) >= chunk_len:
-        public_key[27 - start_byte] ^= val << start_offset
-    else:
-        public_key[27 - start_byte] ^= val << start_offset
-        public_key[27 - next_byte] ^= val >> (8 - start_offset)
+    public_key[12:28] = body
 
     curr_addr[:] = public_key[12:28]
 
+    # Re-sent and restarted keys skip the counter search entirely
+    cached_key = key_cache.lookup(public_key)
+    if cached_key is not None:
+        return cached_key
+
+    search_start = time.perf_counter()
     while not is_valid_pubkey(public_key, valid_key_counter):
         print("-------------------------")
         valid_key_counter += 1
         print(valid_key_counter)
+    key_cache.store(public_key, valid_key_counter, time.perf_counter() - search_start)
 
     return public_key
 
-def send_data_once_blocking(data_to_send, chunk_len, msg_id):
-    len_bytes = len(data_to_send)
-    num_chunks = len_bytes * 8 // chunk_len
-    if len_bytes * 8 % chunk_len:
-        num_chunks += 1
-
-    for chunk_i in range(num_chunks):
-        chunk_value = 0
-        start_bit = chunk_i * chunk_len
-        end_bit = start_bit + chunk_len
-
-        start_byte = start_bit // 8
-        start_bit_offset = start_bit % 8
-
-        bits_in_first_byte = min(8 - start_bit_offset, chunk_len)
-        chunk_value = (data_to_send[start_byte] >> start_bit_offset) & ((1 << bits_in_first_byte) - 1)
-
-        remaining_bits = chunk_len - bits_in_first_byte
-        while remaining_bits > 0:
-            start_byte += 1
-            bits_to_extract = min(remaining_bits, 8)
-            chunk_value |= (data_to_send[start_byte] & ((1 << bits_to_extract) - 1)) << bits_in_first_byte
-            bits_in_first_byte += bits_to_extract
-            remaining_bits -= bits_to_extract
+def send_data_once_blocking(data_to_send, chunk_len, msg_id, key_cache):
+    # Chunk values and the XOR-accumulated body after each chunk, in one pass
+    plan = plan_chunks(data_to_send, chunk_len, start_addr)
 
-        final_key =  set_addr_and_payload_for_byte(chunk_i, msg_id, chunk_value, chunk_len)
+    for body in plan.bodies:
+        final_key = set_addr_and_payload_for_body(msg_id, body.tobytes(), key_cache)
 
     return final_key
 
@@ -187,38 +155,45 @@ def start_advertising(key, interval_ms=20):
     # # Start BLE advertising
     # run_hci_cmd(["0x08", "0x000a"] + ["01"], wait=1)
 
+CSV_PATH = '/home/lab/Desktop/Sara-old/Desktop/test3_data_1.csv'
+# Byte offset of the first unsent row, replaces last_processed_timestamp.txt
+OFFSET_PATH = '/home/lab/Desktop/last_processed_offset.txt'
+# Read once, when OFFSET_PATH does not exist yet, so an upgraded
+# deployment starts after the last row it sent instead of at the top
+TIMESTAMP_PATH = '/home/lab/Desktop/last_processed_timestamp.txt'
+# --follow: rows waiting for the radio, and what to evict when that fills up
+TX_QUEUE_SIZE = 32
+TX_QUEUE_POLICY = DROP_OLDEST  # or DOWNSAMPLE
+# Evicted rows: "resend" keeps them unsent in OFFSET_PATH, so the next run
+# starts at the oldest of them; "skip" lets the offset move past them
+EVICTED_ROWS = "resend"
+ROW_PRIORITY = None  # optional function(row text) -> int, higher is sent first (e.g. alarms)
+METRICS_DIR = None  # e.g. /var/lib/node_exporter/textfile_collector: <script>.prom and .json, rewritten every 15 s
+
+
 def load_last_processed_timestamp():
     try:
-        with open('/home/lab/Desktop/last_processed_timestamp.txt', 'r') as f:
+        with open(TIMESTAMP_PATH, 'r') as f:
             return float(f.read().strip())
     except FileNotFoundError:
         return None
 
-def save_last_processed_timestamp(timestamp):
-    with open('/home/lab/Desktop/last_processed_timestamp.txt', 'w') as f:
-        f.write(str(timestamp))
 
 def main(args):
-    last_processed_timestamp = load_last_processed_timestamp()
-    df = pd.read_csv('/home/lab/Desktop/Sara-old/Desktop/test3_data_1.csv', header=None, usecols=[0, 1], names=['timestamp', 'Data_2'])
+    exporter = Exporter.to_directory(METRICS_DIR, "29july_datasend")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--follow', action='store_true', help="keep sending rows as the CSV grows")
+    args = parser.parse_args(args)
+
+    key_cache = KeyCache(KEY_CACHE_PATH)
+    # Seeks to unread rows and parses them a slice at a time
+    tail = CsvTail(CSV_PATH, OFFSET_PATH, usecols=[0, 1], names=['timestamp', 'Data_2'], dtype={'Data_2': str})
+    if not os.path.exists(OFFSET_PATH):
+        last_processed_timestamp = load_last_processed_timestamp()
+        if last_processed_timestamp is not None:
+            print("Resuming after timestamp", last_processed_timestamp, "at offset",
+                  tail.seek_past('timestamp', last_processed_timestamp))
 
-    # Filter rows with new data since the last processed timestamp
-    if last_processed_timestamp:
-        new_data = df[df['timestamp'] > last_processed_timestamp]
-    else:
-        new_data = df
-
-    data_values = new_data['Data_2'].values
-    b_Data = np.array([s.encode('utf-8') for s in data_values])
-
-    #fn = pd.read_csv('/home/lab/Desktop/test_data.csv', header = None, usecols = [0,1], names = ['timestamp', 'Data'])
-    #F = fn.iloc[:, -1].values
-    #F['Data'] = F['Data'].astype('string')
-    #F = fn.iloc[239:, -1].values
-    #s_Data = np.array([s.strip("b'") for s in F])
-    #b_Data = np.array([s.encode('utf-8') for s in s_Data])
-    print(b_Data)
-    
     # Constants
     NUM_MESSAGES = 2
     REPEAT_MESSAGE_TIMES = 1
@@ -226,24 +201,85 @@ def main(args):
 
     # Initialize current message ID and message data
     current_message_id = 0
-    for i in range(len(b_Data)):
-      current_message_id += 1
-      data_to_send = b_Data[i]
 
-  # Print message bytes
-      print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
-
-# Message sending loop
-      for _ in range(NUM_MESSAGES):
-          for _ in range(REPEAT_MESSAGE_TIMES):
-              key = send_data_once_blocking(data_to_send, 8, current_message_id)
-              start_advertising(key)
-              time.sleep(MESSAGE_DELAY)
-    if not new_data.empty:
-        latest_timestamp = new_data['timestamp'].max()
-        save_last_processed_timestamp(latest_timestamp)
+    def send_row(data_to_send):
+        nonlocal current_message_id
+        current_message_id += 1
+
+        # Print message bytes
+        print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
+
+        # Message sending loop
+        for _ in range(NUM_MESSAGES):
+            for _ in range(REPEAT_MESSAGE_TIMES):
+                key = send_data_once_blocking(data_to_send, 8, current_message_id, key_cache)
+                start_advertising(key)
+                metrics.sleep(MESSAGE_DELAY)
+
+    if args.follow:
+        # Rows are read on their own thread into a bounded queue; when they
+        # arrive faster than the radio drains them the newest go first and
+        # the excess is evicted instead of piling up as ever staler backlog.
+        # Rows go out of file order, so the ledger commits the offset of the
+        # oldest row not yet sent.
+        if EVICTED_ROWS not in ("resend", "skip"):
+            sys.exit("EVICTED_ROWS must be resend or skip")
+        ledger = RowLedger(tail)
+
+        def dropped(row, reason):
+            start, _ = row
+            if EVICTED_ROWS == "skip":
+                ledger.done(start)
+
+        tx_queue = TransmitQueue(TX_QUEUE_SIZE, TX_QUEUE_POLICY, on_drop=dropped)
+        failure = []
+
+        def ingest():
+            try:
+                for new_data in tail.follow():
+                    for start, s in zip(new_data.index, new_data['Data_2'].values):
+                        priority = ROW_PRIORITY(s) if ROW_PRIORITY is not None else 0
+                        ledger.track(start)
+                        tx_queue.put((start, s.encode('utf-8')), priority)
+                    ledger.mark(tail.offset)
+            except Exception as e:
+                failure.append(e)  # re-raised on the main thread
+            finally:
+                tx_queue.close()
+
+        threading.Thread(target=ingest, name="ingest", daemon=True).start()
+        try:
+            for start, data_to_send in tx_queue:
+                send_row(data_to_send)
+                # Only rows that went out are skipped next run
+                ledger.done(start)
+                ledger.commit()
+        finally:
+            print("Queue:", tx_queue.stats(), "rows left for next run:", ledger.outstanding())
+        if failure:
+            raise failure[0]
+    else:
+        for new_data in tail.batches():
+            b_Data = [s.encode('utf-8') for s in new_data['Data_2'].values]
+            #fn = pd.read_csv('/home/lab/Desktop/test_data.csv', header = None, usecols = [0,1], names = ['timestamp', 'Data'])
+            #F = fn.iloc[:, -1].values
+            #F['Data'] = F['Data'].astype('string')
+            #F = fn.iloc[239:, -1].values
+            #s_Data = np.array([s.strip("b'") for s in F])
+            #b_Data = np.array([s.encode('utf-8') for s in s_Data])
+            print(b_Data)
+
+            for data_to_send in b_Data:
+                send_row(data_to_send)
+            # Only rows that went out are skipped next run
+            tail.commit()
+    print("Key cache:", key_cache.stats())
+    key_cache.close()
+    if exporter is not None:
+        exporter.close()
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    # --profile PREFIX writes PREFIX.pstats and PREFIX.collapsed for one run
+    run_main(main, sys.argv[1:])
 
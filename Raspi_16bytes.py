@@ -6,55 +6,12 @@ import time
 import struct
 import argparse
 import sys
-from ecdsa.keys import VerifyingKey
-from ecdsa.curves import NIST224p
-
-def advertisement_template():
-    adv = ""
-    adv += "1e"  # length (30)
-    adv += "ff"  # manufacturer specific data
-    adv += "4c00"  # company ID (Apple)
-    adv += "1219"  # offline finding type and length
-    adv += "00"  # state
-    for _ in range(22):  # key[6:28]
-        adv += "00"
-    adv += "00"  # first two bits of key[0]
-    adv += "00"  # hint
-    return bytearray.fromhex(adv)
-
-
-def bytes_to_strarray(bytes_, with_prefix=False):
-    if with_prefix:
-        return [hex(b) for b in bytes_]
-    else:
-        return [format(b, "x") for b in bytes_]
-
-
-def is_valid_pubkey(public_key, valid_key_counter=0):  # Check if the compressed public key is valid
-    temp_pub_key = bytearray(29)
-    temp_pub_key[0] = 0x02
-
-    #valid_key_counter = 0
-    #print(valid_key_counter)
-    counter_bytes = valid_key_counter.to_bytes(2, 'big')
-    public_key[6:8] = counter_bytes
-
-    temp_pub_key[1:] = public_key
-    temp_pub_key
-    #print(public_key)
-    try:
-      VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-
-    except:
-      return False
-    else:
-      print("valid key!")
-      vk = VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-      pub_key = vk.to_string('uncompressed')
-      #print(pub_key.hex())
-      #print(public_key.hex())
-      print(bytearray.fromhex(public_key.hex()))
-      return True
+from tagalong.keycache import KeyCache
+from tagalong.metrics import Exporter
+from tagalong.profiling import run_main
+from tagalong.hci import open_transport
+from tagalong.advertiser import Advertiser, ExtendedAdvertiser, advertising_address, advertisement_data
+from tagalong.schedule import KeyScheduleBuilder
 
 def send_public_key(public_key):
     """Simulate sending the public key."""
@@ -74,6 +31,19 @@ curr_addr = start_addr.copy()
 modem_id = 0x61616161 # Example modem ID
 start_addr = [0] * 16  # Example start address
 curr_addr = start_addr.copy()
+KEY_CACHE_PATH = None  # valid counters persist across runs; None: ~/.cache/tagalong/key_cache.sqlite
+ROTATE_ADDRESS = True  # LE random address per key instead of vendor BD address + bluetoothd restart
+ADVERTISING_DWELL = 1.0  # seconds each start_advertising() keeps the key on air
+EXTENDED_ADV_SETS = 0  # >0: keep that many consecutive keys on air at once (BT5 extended advertising)
+METRICS_DIR = None  # e.g. /var/lib/node_exporter/textfile_collector: <script>.prom and .json, rewritten every 15 s
+# Counter searches of a message on a process pool: MIN_PARALLEL keys or more go to KEY_SEARCH_PROCESSES
+# workers (None: one per core). None searches in-process; run benchmarks/key_schedule.py on the board to pick it
+KEY_SEARCH_PROCESSES = None
+MIN_PARALLEL = None
+if EXTENDED_ADV_SETS:
+    advertiser = ExtendedAdvertiser(open_transport("hci0"), EXTENDED_ADV_SETS, dwell=ADVERTISING_DWELL)
+else:
+    advertiser = Advertiser(open_transport("hci0"), rotate=ROTATE_ADDRESS, dwell=ADVERTISING_DWELL)
 modem_bytearray = bytearray(4) # Initialize modem_id as a bytearray of 4 bytes
 
 # Convert modem_id to a byte array (little-endian to match memory layout in C)
@@ -83,77 +53,12 @@ modem_id_bytes = modem_id.to_bytes(4, byteorder='little')
 copy_4b_big_endian(modem_bytearray, modem_id_bytes)
 
 
-def set_addr_and_payload_for_byte(index,  msg_id, val, chunk_len):
-    valid_key_counter = 0
-    public_key = bytearray(28)
-    public_key[0] = 0xBA  # magic value
-    public_key[1] = 0xBE
-    public_key[2:6] =  modem_bytearray
-    public_key[6:8] = b'\x00\x00'
-   # Convert msg to a byte array (big-endian)
-    msg_bytes = msg_id.to_bytes(4, byteorder='big')
-    public_key[8:12] = msg_bytes
-
-    if index:
-        public_key[12:28] = curr_addr
-    else:
-        public_key[12:28] = start_addr
-
-    bit_index = index * chunk_len
-    byte_index = bit_index // 8
-
-    start_byte = byte_index % 16
-    next_byte = (start_byte + 1) % 16
-
-    start_offset = bit_index % 8
-
-    if (8 - start_offset) >= chunk_len:
-        public_key[27 - start_byte] ^= val << start_offset
-    else:
-        public_key[27 - start_byte] ^= val << start_offset
-        public_key[27 - next_byte] ^= val >> (8 - start_offset)
-
-    curr_addr[:] = public_key[12:28]
-
-    while not is_valid_pubkey(public_key, valid_key_counter):
-            print("-------------------------")
-            valid_key_counter += 1
-            print(valid_key_counter)
-
-    return public_key
-    
-
-
-        
-    
-def send_data(data_to_send, chunk_len, msg_id):
+def send_data(data_to_send, chunk_len, msg_id, key_schedule):
     def send_data_once_blocking(data_segment, chunk_len, msg_id):
-        len_bytes = len(data_segment)
-        num_chunks = len_bytes * 8 // chunk_len
-        if len_bytes * 8 % chunk_len:
-            num_chunks += 1
-
-        for chunk_i in range(num_chunks):
-            chunk_value = 0
-            start_bit = chunk_i * chunk_len
-            end_bit = start_bit + chunk_len
-
-            start_byte = start_bit // 8
-            start_bit_offset = start_bit % 8
-
-            bits_in_first_byte = min(8 - start_bit_offset, chunk_len)
-            chunk_value = (data_segment[start_byte] >> start_bit_offset) & ((1 << bits_in_first_byte) - 1)
-
-            remaining_bits = chunk_len - bits_in_first_byte
-            while remaining_bits > 0:
-                start_byte += 1
-                bits_to_extract = min(remaining_bits, 8)
-                chunk_value |= (data_segment[start_byte] & ((1 << bits_to_extract) - 1)) << bits_in_first_byte
-                bits_in_first_byte += bits_to_extract
-                remaining_bits -= bits_to_extract
-
-            final_key = set_addr_and_payload_for_byte(chunk_i, msg_id, chunk_value, chunk_len)
-        return final_key
+        # The XOR chain is computed up front, the counter searches run on the pool
+        keys = key_schedule.build(modem_bytearray, msg_id, data_segment, chunk_len)
+        curr_addr[:] = keys[-1][12:28]
+        return keys[-1]
 
     segment_size = 16  # 16 bytes
 
@@ -172,50 +77,21 @@ def send_data(data_to_send, chunk_len, msg_id):
             segment = data_to_send[start_index:end_index]
 
             print(f"Sending segment {segment_index + 1}/{total_segments}: {segment.hex()}")
-            send_data_once_blocking(segment, chunk_len, msg_id + segment_index)
-    return final_key   
+            final_key = send_data_once_blocking(segment, chunk_len, msg_id + segment_index)
+    return final_key
    
 
-def run_hci_cmd(cmd, hci="hci0", wait=1):
-    cmd_ = ["hcitool", "-i", hci, "cmd"]
-    cmd_ += cmd
-    print(cmd_)
-    subprocess.run(cmd_)
-    if wait > 0:
-        time.sleep(wait)
-
-
 def start_advertising(key, interval_ms=20):
-    addr = bytearray(key[:6])
-    addr[0] |= 0b11000000
-
-    adv = advertisement_template()
-    adv[7:29] = key[6:28]
-    adv[29] = key[0] >> 6
+    addr = advertising_address(key)
+    adv = advertisement_data(key)
 
     print(f"key     ({len(key):2}) {key.hex()}")
     print(f"address ({len(addr):2}) {addr.hex()}")
     print(f"payload ({len(adv):2}) {adv.hex()}")
 
-    # Set BLE address
-    run_hci_cmd(["0x3f", "0x001"] + bytes_to_strarray(addr, with_prefix=True)[::-1])
-    subprocess.run(["systemctl", "restart", "bluetooth"])
-    time.sleep(1)
-
-    # Set BLE advertisement payload
-    run_hci_cmd(["0x08", "0x0008"] + [format(len(adv), "x")] + bytes_to_strarray(adv))
-
-    # Set BLE advertising mode
-    interval_enc = struct.pack("<h", interval_ms)
-    hci_set_adv_params = ["0x08", "0x0006"]
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += ["03", "00", "00", "00", "00", "00", "00", "00", "00"]
-    hci_set_adv_params += ["07", "00"]
-    run_hci_cmd(hci_set_adv_params)
-
-    # Start BLE advertising
-    run_hci_cmd(["0x08", "0x000a"] + ["01"], wait=1)
+    # Pre-packed HCI commands over a persistent socket instead of hcitool;
+    # each returns on the controller's completion event, then the key dwells
+    advertiser.start(key, interval_ms)
 
 def load_last_processed_timestamp():
     try:
@@ -230,6 +106,9 @@ def save_last_processed_timestamp(timestamp):
 
 
 def main(args):
+    exporter = Exporter.to_directory(METRICS_DIR, "Raspi_16bytes")
+    key_cache = KeyCache(KEY_CACHE_PATH)
+    key_schedule = KeyScheduleBuilder(KEY_SEARCH_PROCESSES, key_cache, MIN_PARALLEL)
     # parser = argparse.ArgumentParser()
     # parser.add_argument("--key", "-k", help="Advertisement key (base64)")
     # args = parser.parse_args(args)
@@ -260,14 +139,24 @@ def main(args):
     print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
 
     # Message sending loop
-    for _ in range(NUM_MESSAGES):
-        current_message_id += 1
-        for _ in range(REPEAT_MESSAGE_TIMES):
-            key = send_data(data_to_send, 8, current_message_id)
-            start_advertising(key)
+    try:
+        for _ in range(NUM_MESSAGES):
+            current_message_id += 1
+            for _ in range(REPEAT_MESSAGE_TIMES):
+                key = send_data(data_to_send, 8, current_message_id, key_schedule)
+                start_advertising(key)
+    finally:
+        # Left on, the next run's first address change is disallowed
+        advertiser.stop()
+    key_schedule.close()
+    print("Key cache:", key_cache.stats())
+    key_cache.close()
+    if exporter is not None:
+        exporter.close()
             
     
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    # --profile PREFIX writes PREFIX.pstats and PREFIX.collapsed for one run
+    run_main(main, sys.argv[1:])
@@ -5,9 +5,12 @@ import subprocess
 import time
 import struct
 import argparse
+import os
 import sys
-from ecdsa.keys import VerifyingKey
-from ecdsa.curves import NIST224p
+
+# Key validity lives in the tagalong package at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from tagalong.keysearch import is_valid_key  # noqa: E402
 
 def advertisement_template():
     adv = ""
@@ -31,30 +34,14 @@ def bytes_to_strarray(bytes_, with_prefix=False):
 
 
 def is_valid_pubkey(public_key, valid_key_counter=0):  # Check if the compressed public key is valid
-    temp_pub_key = bytearray(29)
-    temp_pub_key[0] = 0x02
-
-    #valid_key_counter = 0
-    #print(valid_key_counter)
     counter_bytes = valid_key_counter.to_bytes(2, 'big')
     public_key[6:8] = counter_bytes
 
-    temp_pub_key[1:] = public_key
-    temp_pub_key
-    #print(public_key)
-    try:
-      VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-
-    except:
-      return False
-    else:
-      print("valid key!")
-      vk = VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-      pub_key = vk.to_string('uncompressed')
-      #print(pub_key.hex())
-      #print(public_key.hex())
-      print(bytearray.fromhex(public_key.hex()))
-      return True
+    if not is_valid_key(public_key):
+        return False
+    print("valid key!")
+    print(bytearray.fromhex(public_key.hex()))
+    return True
 
 def send_public_key(public_key):
     """Simulate sending the public key."""
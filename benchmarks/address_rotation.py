@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Keys/hour with the vendor BD address + bluetoothd restart vs random address rotation.
+
+By default both modes run against a FakeController on a virtual clock,
+so the numbers follow from the modelled command latency and restart
+time. With --hci the commands go to a real adapter and wall time is
+measured (needs root):
+
+    python3 benchmarks/address_rotation.py
+    sudo python3 benchmarks/address_rotation.py --hci hci0 --keys 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tagalong.advertiser import Advertiser, restart_bluetoothd  # noqa: E402
+from tagalong.hci import FakeController, open_transport  # noqa: E402
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def time(self):
+        return self.now
+
+
+class LatencyTransport:
+    def __init__(self, transport, clock, latency):
+        self.transport = transport
+        self.clock = clock
+        self.latency = latency
+
+    def send_command(self, ogf, ocf, params=b""):
+        self.clock.sleep(self.latency)
+        return self.transport.send_command(ogf, ocf, params)
+
+
+def test_keys(n):
+    return [bytes([0xBA, 0xBE, 0x61, 0x61, 0x61, 0x61, i >> 8, i & 0xFF]) + bytes(range(20)) for i in range(n)]
+
+
+def run_simulated(rotate, args):
+    clock = VirtualClock()
+    transport = LatencyTransport(FakeController(), clock, args.command_latency)
+    advertiser = Advertiser(transport, restart=lambda: clock.sleep(args.restart_seconds),
+                            command_wait=args.command_wait, rotate=rotate, sleep=clock.sleep)
+    for key in test_keys(args.keys):
+        advertiser.start(key)
+    return clock.time() / args.keys
+
+
+def run_hardware(rotate, args):
+    advertiser = Advertiser(open_transport(args.hci), restart=restart_bluetoothd,
+                            command_wait=args.command_wait, rotate=rotate)
+    start = time.perf_counter()
+    for key in test_keys(args.keys):
+        advertiser.start(key)
+    advertiser.stop()
+    return (time.perf_counter() - start) / args.keys
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--hci", help="run against this adapter instead of the simulation")
+    parser.add_argument("--command-wait", type=float, default=0.0, help="fixed sleep after each command (s)")
+    parser.add_argument("--command-latency", type=float, default=0.002, help="simulated command latency (s)")
+    parser.add_argument("--restart-seconds", type=float, default=2.0, help="simulated bluetoothd restart (s)")
+    parser.add_argument("--dwell", type=float, default=0.0, help="advertising time per key added to both modes (s)")
+    args = parser.parse_args(argv)
+
+    run = run_hardware if args.hci else run_simulated
+    results = {}
+    for name, rotate in (("restart", False), ("rotate", True)):
+        per_key = run(rotate, args) + args.dwell
+        results[name] = per_key
+        print(f"{name:8} {per_key * 1000:9.1f} ms/key {3600 / per_key:10.0f} keys/hour")
+    gain = results["restart"] / results["rotate"]
+    print(f"rotation: {3600 / results['rotate'] - 3600 / results['restart']:+.0f} keys/hour ({gain:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""End-to-end throughput of the sender scripts against a simulated controller.
+
+Each entry point is loaded as a module and its main() runs with the HCI
+transport, bluetoothd restarts and time.sleep redirected to a
+SimulatedController on a virtual clock, the key cache swapped for an
+empty in-memory one and CSV inputs replaced by generated fixtures. No
+radio or root is needed:
+
+    python3 benchmarks/entry_points.py
+    python3 benchmarks/entry_points.py --only send_csv_data --rows 50
+
+The reported time is the virtual radio time plus the real compute time
+of the run. For the pipelined senders the key search actually overlaps
+the dwell, so their figure is an upper bound.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tagalong.advertiser import Advertiser, ExtendedAdvertiser  # noqa: E402
+from tagalong.schedule import KeyScheduleBuilder  # noqa: E402
+from tagalong.scheduler import AsyncScheduler  # noqa: E402
+from tagalong.simcontroller import SimClock, SimulatedController  # noqa: E402
+
+ENTRY_POINTS = {
+    "Raspi_16bytes": "Raspi_16bytes.py",
+    "Raspi-1byte": "TagAlong-8bit/Firmware/Linux_HCI/Raspi-1byte.py",
+    "30Aug_raspi": "30Aug_raspi.py",
+    "send_csv_data": "send_csv_data.py",
+    "exp_i_2": "exp_i_2.py",
+}
+CHUNK_LEN = 8  # every entry point sends 8 bits per key
+
+
+def write_fixtures(directory, rows):
+    text_csv = os.path.join(directory, "text.csv")
+    hex_csv = os.path.join(directory, "hex.csv")
+    with open(text_csv, "w") as f:
+        f.write("Timestamp,Data_2\n")
+        for i in range(rows):
+            f.write(f"{1722942819 + i},T{20 + (i % 70) / 10:.2f}H{40 + i % 9}\n")
+    with open(hex_csv, "w") as f:
+        f.write("Timestamp,Data_1,Data_2,Data_3,Data_4,Data_5\n")
+        for i in range(rows):
+            fields = [f":{v:.1f}".encode().hex() for v in (21 + i % 5, 40 + i % 7, 3.3, i % 10, 99)]
+            f.write(f"{1722942819 + i}," + ",".join(fields) + "\n")
+    return {"send_csv_data": text_csv, "exp_i_2": hex_csv}
+
+
+class PandasProxy:
+    """pandas with read_csv pointed at a fixture file."""
+
+    def __init__(self, csv_path):
+        import pandas
+        self._pandas = pandas
+        self._csv_path = csv_path
+
+    def read_csv(self, path, *args, **kwargs):
+        return self._pandas.read_csv(self._csv_path, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pandas, name)
+
+
+class Timed:
+    def __init__(self, fn, totals, kind):
+        self.fn = fn
+        self.totals = totals
+        self.kind = kind
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            self.totals[self.kind] = self.totals.get(self.kind, 0.0) + time.perf_counter() - start
+
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location("bench_" + name.replace("-", "_"), os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def patch(module, sim, clock, fixtures, name, compute):
+    real_start = time.perf_counter()
+    module.time = types.SimpleNamespace(
+        sleep=clock.sleep,
+        time=lambda: clock.now + time.perf_counter() - real_start,
+        perf_counter=time.perf_counter,
+        monotonic=time.monotonic,
+    )
+    module.subprocess = types.SimpleNamespace(run=sim.run)
+    if hasattr(module, "AsyncScheduler"):
+        async def virtual_sleep(seconds):
+            clock.sleep(seconds)
+            await asyncio.sleep(0)
+        module.AsyncScheduler = functools.partial(AsyncScheduler, sleep=virtual_sleep)
+    if name in fixtures:
+        module.pd = PandasProxy(fixtures[name])
+    if hasattr(module, "save_last_processed_timestamp"):
+        module.save_last_processed_timestamp = lambda timestamp: None
+
+    if hasattr(module, "KEY_CACHE_PATH"):
+        module.KEY_CACHE_PATH = ":memory:"
+    if hasattr(module, "KeyScheduleBuilder"):
+        def key_schedule(*args, **kwargs):
+            builder = KeyScheduleBuilder(*args, **kwargs)
+            builder.resolve = Timed(builder.resolve, compute, "crypto")
+            return builder
+        module.KeyScheduleBuilder = key_schedule
+    if hasattr(module, "advertiser"):
+        if isinstance(module.advertiser, ExtendedAdvertiser):
+            module.advertiser = ExtendedAdvertiser(sim, module.advertiser.requested_sets,
+                                                   dwell=module.advertiser.dwell, sleep=clock.sleep)
+        else:
+            module.advertiser = Advertiser(sim, restart=sim.restart, rotate=module.advertiser.rotate,
+                                           dwell=module.advertiser.dwell, sleep=clock.sleep)
+    if hasattr(module, "is_valid_pubkey"):
+        module.is_valid_pubkey = Timed(module.is_valid_pubkey, compute, "crypto")
+
+
+def run_entry_point(name, fixtures, args):
+    clock = SimClock()
+    sim = SimulatedController(clock, command_latency=args.command_latency, restart_seconds=args.restart_seconds)
+    compute = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        module = load(name, ENTRY_POINTS[name])
+        patch(module, sim, clock, fixtures, name, compute)
+        start = time.perf_counter()
+        module.main([])
+        real = time.perf_counter() - start
+
+    advertised = sim.finish()
+    unique_keys = len({key for _, _, key in advertised})
+    total = clock.now + real
+    crypto = compute.get("crypto", 0.0)
+    return {
+        "keys": len(advertised),
+        "unique_keys": unique_keys,
+        "seconds": total,
+        "keys_per_s": len(advertised) / total if total else 0.0,
+        "bits_per_hour": unique_keys * CHUNK_LEN * 3600 / total if total else 0.0,
+        "crypto": crypto,
+        "compute": real - crypto,
+        "hci": clock.spent.get("hci", 0.0),
+        "restart": clock.spent.get("restart", 0.0),
+        "sleep": clock.spent.get("sleep", 0.0),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", action="append", choices=sorted(ENTRY_POINTS), help="run just these entry points")
+    parser.add_argument("--rows", type=int, default=20, help="rows in the generated CSV fixtures")
+    parser.add_argument("--command-latency", type=float, default=0.0005, help="simulated HCI command latency (s)")
+    parser.add_argument("--restart-seconds", type=float, default=2.0, help="simulated bluetoothd restart (s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = write_fixtures(directory, args.rows)
+        print(f"{'entry point':15} {'keys':>6} {'unique':>6} {'keys/s':>8} {'bits/hour':>10}"
+              f" {'crypto':>8} {'compute':>8} {'hci':>8} {'restart':>8} {'sleep':>9}")
+        for name in args.only or ENTRY_POINTS:
+            r = run_entry_point(name, fixtures, args)
+            print(f"{name:15} {r['keys']:6} {r['unique_keys']:6} {r['keys_per_s']:8.3f} {r['bits_per_hour']:10.0f}"
+                  f" {r['crypto']:8.3f} {r['compute']:8.3f} {r['hci']:8.3f} {r['restart']:8.1f} {r['sleep']:9.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Binary wire formats end to end: sender encoding -> FetchDecoder -> row decoder.
+
+Rows are encoded the way send_csv_data sends them, every key the sender
+would advertise is seeded into a MemoryReportSource, and the messages
+are recovered with FetchDecoder and the format's decoder. Each format
+runs once stuffed (cobs, as sent) and once raw for comparison; the run
+exits non-zero if a stuffed format does not return every row:
+
+    python3 benchmarks/fetch_roundtrip.py
+    python3 benchmarks/fetch_roundtrip.py --rows 20 --only schema
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tagalong import cobs, fetch  # noqa: E402
+from tagalong.fec import FecDecoder, encode_blocks  # noqa: E402
+from tagalong.schema import DeltaTime, Fixed16, Schema  # noqa: E402
+from tagalong.sparse import SparseDecoder, SparseEncoder  # noqa: E402
+
+MODEM = 0x14151617
+CHUNK_LEN = 8
+
+
+def sensor_rows(n):
+    # Small deltas and small values: both put 0x00 bytes into the records
+    return [{"Timestamp": 1722942819 + 2 * i, "Data_2": round(2.5 + (i % 7) * 0.01, 2)} for i in range(n)]
+
+
+def schema_format(rows):
+    schema = Schema([DeltaTime("Timestamp"), Fixed16("Data_2", decimals=2)])
+    encoder = schema.encoder()
+    messages = [encoder.pack(row) for row in rows]
+
+    def decode(received):
+        decoder = schema.decoder()
+        out = []
+        for message in received:
+            try:
+                out.append(decoder.unpack(message) if message else None)
+            except ValueError:
+                out.append(None)
+        return out
+
+    return messages, decode, rows
+
+
+def text_rows(rows):
+    return [f"T{row['Data_2']:.2f}H{40 + i % 3}".encode() for i, row in enumerate(rows)]
+
+
+def sparse_format(rows):
+    rows = text_rows(rows)
+    encoder = SparseEncoder()
+    messages = [encoder.encode(row) for row in rows]
+
+    def decode(received):
+        decoder = SparseDecoder()
+        out = []
+        for message in received:
+            try:
+                out.append(decoder.decode(message) if message else None)
+            except ValueError:
+                out.append(None)
+        return out
+
+    return messages, decode, rows
+
+
+def fec_format(rows, data=4, parity=2):
+    # Blocks of 4 + 2 with a short tail block; one data message per block is
+    # never received, so every block is rebuilt from parity
+    rows = text_rows(rows)
+    rows[1::3] = [row[:3] for row in rows[1::3]]  # shorter segments are zero-padded
+    messages = list(encode_blocks(rows, data, parity))
+    first = 0
+    for start in range(0, len(rows), data):
+        messages[first + 1 if start + 1 < len(rows) else first] = None
+        first += min(data, len(rows) - start) + parity
+
+    def decode(received):
+        decoder = FecDecoder()
+        out = []
+        for msg_id, message in enumerate(received):
+            if not message:
+                continue
+            try:
+                out += decoder.add(msg_id, message) or []
+            except ValueError:
+                pass
+        return out
+
+    return messages, decode, rows
+
+
+FORMATS = {
+    "schema": schema_format,
+    "sparse": sparse_format,
+    "fec": fec_format,
+}
+
+
+async def fetch_messages(messages, stuffed):
+    ids = []
+    for msg_id, message in enumerate(messages):
+        if message is not None:  # None: lost on the way
+            ids += fetch.advertised_ids(MODEM, msg_id, message, CHUNK_LEN)
+    decoder = fetch.FetchDecoder(MODEM, CHUNK_LEN, fetch.MemoryReportSource(ids), stuffed=stuffed)
+    found = await decoder.decode(range(len(messages)))
+    return [found[msg_id] for msg_id in range(len(messages))], decoder.lookups
+
+
+def run(name, rows, stuffed):
+    messages, decode, expected = FORMATS[name](rows)
+    sent = [cobs.encode(m) if stuffed and m is not None else m for m in messages]
+    start = time.perf_counter()
+    received, lookups = asyncio.run(fetch_messages(sent, stuffed))
+    seconds = time.perf_counter() - start
+    recovered = sum(got == want for got, want in zip(decode(received), expected))
+    return {
+        "messages": len(sent),
+        "wire_bytes": sum(len(m) for m in sent if m is not None),
+        "lookups": lookups,
+        "seconds": seconds,
+        "recovered": recovered,
+        "rows": len(expected),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--only", action="append", choices=sorted(FORMATS), help="run just these formats")
+    args = parser.parse_args(argv)
+
+    rows = sensor_rows(args.rows)
+    failed = []
+    print(f"{'format':8} {'wire':8} {'messages':>8} {'bytes':>6} {'lookups':>8} {'seconds':>8} {'rows':>9}")
+    for name in args.only or FORMATS:
+        for stuffed in (True, False):
+            r = run(name, rows, stuffed)
+            print(f"{name:8} {'stuffed' if stuffed else 'raw':8} {r['messages']:8} {r['wire_bytes']:6}"
+                  f" {r['lookups']:8} {r['seconds']:8.2f} {r['recovered']:4}/{r['rows']:<4}")
+            if stuffed and r["recovered"] != r["rows"]:
+                failed.append(name)
+    if failed:
+        sys.exit(f"rows lost in: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
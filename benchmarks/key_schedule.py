@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Serial vs process-pool counter search in KeyScheduleBuilder, per batch size.
+
+Each batch of fresh templates (one message's keys) is resolved once on
+the calling process and once on a warm pool, and the smallest batch
+where the pool wins is the value to pass as min_parallel. Pool start-up
+is paid once per builder and reported separately:
+
+    python3 benchmarks/key_schedule.py
+    python3 benchmarks/key_schedule.py --sizes 1 2 4 8 16 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tagalong.schedule import KeyScheduleBuilder, key_template, modem_bytes  # noqa: E402
+
+MODEM = modem_bytes(0x14151617)
+
+
+def templates(n, seed):
+    # Distinct bodies so every key needs its own search
+    return [key_template(MODEM, seed, (seed * 1000 + i).to_bytes(16, 'big')) for i in range(n)]
+
+
+def timed(builder, batches):
+    start = time.perf_counter()
+    for batch in batches:
+        builder.resolve(batch)
+    return (time.perf_counter() - start) / len(batches)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--repeat", type=int, default=20, help="batches per size and mode")
+    parser.add_argument("--processes", type=int, default=None, help="pool size (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    serial = KeyScheduleBuilder(processes=1)
+    pool = KeyScheduleBuilder(processes=args.processes, min_parallel=1)
+    start = time.perf_counter()
+    pool.resolve(templates(1, 0))
+    print(f"pool start-up ({args.processes or multiprocessing.cpu_count()} processes): "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    break_even = None
+    seed = 1
+    for size in args.sizes:
+        batches = [templates(size, seed + i) for i in range(args.repeat)]
+        seed += args.repeat
+        t_serial = timed(serial, batches)
+        batches = [templates(size, seed + i) for i in range(args.repeat)]
+        seed += args.repeat
+        t_pool = timed(pool, batches)
+        if break_even is None and t_pool < t_serial:
+            break_even = size
+        print(f"{size:4} keys  serial {t_serial * 1000:8.2f} ms  pool {t_pool * 1000:8.2f} ms  "
+              f"({t_serial / t_pool:.2f}x)")
+    pool.close()
+    if break_even is None:
+        print("pool never wins: keep the serial default (min_parallel=None)")
+    else:
+        print(f"pool wins from {break_even} keys: min_parallel={break_even}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -5,51 +5,31 @@ import subprocess
 import time
 import struct
 import argparse
+import asyncio
 import sys
-from ecdsa.keys import VerifyingKey
-from ecdsa.curves import NIST224p
+from tagalong.keysearch import is_valid_key
+from tagalong.keycache import KeyCache
+from tagalong.metrics import Exporter
+from tagalong.hci import open_transport
+from tagalong.advertiser import Advertiser, ExtendedAdvertiser, advertising_address, advertisement_data
+from tagalong.framing import SegmentPacker
+from tagalong import cobs
+from tagalong.fec import encode_blocks
+from tagalong.repetition import RepetitionController
+from tagalong.scheduler import AsyncScheduler, TransmitJob
+from tagalong.hexdecode import decode_hex_columns
 import pandas as pd
 import numpy as np
 
-def advertisement_template():
-    adv = ""
-    adv += "1e"  # length (30)
-    adv += "ff"  # manufacturer specific data
-    adv += "4c00"  # company ID (Apple)
-    adv += "1219"  # offline finding type and length
-    adv += "00"  # state
-    for _ in range(22):  # key[6:28]
-        adv += "00"
-    adv += "00"  # first two bits of key[0]
-    adv += "00"  # hint
-    return bytearray.fromhex(adv)
-
-
-def bytes_to_strarray(bytes_, with_prefix=False):
-    if with_prefix:
-        return [hex(b) for b in bytes_]
-    else:
-        return [format(b, "x") for b in bytes_]
-
-
 def is_valid_pubkey(public_key, valid_key_counter=0):  # Check if the compressed public key is valid
-    temp_pub_key = bytearray(29)
-    temp_pub_key[0] = 0x02
-
     counter_bytes = valid_key_counter.to_bytes(2, 'big')
     public_key[6:8] = counter_bytes
 
-    temp_pub_key[1:] = public_key
-    try:
-        VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-    except:
+    if not is_valid_key(public_key):
         return False
-    else:
-        print("valid key!")
-        vk = VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-        pub_key = vk.to_string('uncompressed')
-        print(bytearray.fromhex(public_key.hex()))
-        return True
+    print("valid key!")
+    print(bytearray.fromhex(public_key.hex()))
+    return True
 
 
 
@@ -62,6 +42,25 @@ def copy_4b_big_endian(dst, src):
 
 start_addr = [0] * 16  # Example start address
 curr_addr = start_addr.copy()
+KEY_CACHE_PATH = None  # valid counters persist across runs; None: ~/.cache/tagalong/key_cache.sqlite
+ROTATE_ADDRESS = True  # LE random address per key instead of vendor BD address + bluetoothd restart
+ADVERTISING_DWELL = 1.0  # seconds each start_advertising() keeps the key on air
+EXTENDED_ADV_SETS = 0  # >0: keep that many consecutive keys on air at once (BT5 extended advertising)
+METRICS_DIR = None  # e.g. /var/lib/node_exporter/textfile_collector: <script>.prom and .json, rewritten every 15 s
+if EXTENDED_ADV_SETS:
+    advertiser = ExtendedAdvertiser(open_transport("hci0"), EXTENDED_ADV_SETS, dwell=ADVERTISING_DWELL)
+else:
+    advertiser = Advertiser(open_transport("hci0"), rotate=ROTATE_ADDRESS, dwell=ADVERTISING_DWELL)
+KEY_LOOKAHEAD = 8  # keys the search stage may run ahead of the radio
+REPEAT_KEY_TIMES = 5
+KEY_DEADLINE = None  # seconds after queueing when a key's remaining repeats are dropped
+FRAME_ROWS = False  # pack several short rows into each 16-byte message instead of one msg_id per row
+FEC_DATA = 8  # messages per erasure-coded block
+FEC_PARITY = 0  # >0: parity messages per block; any FEC_DATA of a block recover it; sent 0x00-free
+FETCH_RESULTS = None  # msg_id,chunk,recovered[,repeats] CSV or DataFetcher log; sets repeats and dwell per chunk position
+FETCH_RESULTS_FORMAT = "csv"  # or "log" for a DataFetcher log
+MAX_ADVERTISING_DWELL = None  # longest dwell for positions that need more than 20 repeats; default 2 x ADVERTISING_DWELL
+DELIVERY_TARGET = 0.95
 
 
 # Constants
@@ -75,7 +74,7 @@ modem_id_bytes = modem_id.to_bytes(4, byteorder='little')
 copy_4b_big_endian(modem_bytearray, modem_id_bytes)
 
 
-def set_addr_and_payload_for_byte(index, msg_id, val):
+def set_addr_and_payload_for_byte(index, msg_id, val, key_cache):
     valid_key_counter = 0
     public_key = bytearray(28)
     public_key[0] = 0xBA  # magic value
@@ -108,84 +107,72 @@ def set_addr_and_payload_for_byte(index, msg_id, val):
 
     curr_addr[:] = public_key[12:28]
 
+    # Re-sent and restarted keys skip the counter search entirely
+    cached_key = key_cache.lookup(public_key)
+    if cached_key is not None:
+        return cached_key
+
+    search_start = time.perf_counter()
     while not is_valid_pubkey(public_key, valid_key_counter):
         print("-------------------------")
         valid_key_counter += 1
         print(valid_key_counter)
+    key_cache.store(public_key, valid_key_counter, time.perf_counter() - search_start)
 
     return public_key
 
 
-def send_data(data_to_send, msg_id):
-    #msg_id = 1  # Set a fixed msg_id
+async def transmit_rows(b_Data, msg_ids, key_cache, repetition=None):
+    # Radio control runs as a task; rows keep being searched and queued
+    # while earlier keys are still on air
+    scheduler = AsyncScheduler(advertiser.load, maxsize=KEY_LOOKAHEAD)
+    radio = asyncio.create_task(scheduler.run())
 
-    def send_data_once_blocking(byte, index):
-        print(f"Sending byte {index}: {byte:02x}")
-        key = set_addr_and_payload_for_byte(index, msg_id, byte)
-        
-        # Start advertising for the last key sent
-        for _ in range(5):
-            start_advertising(key)
+    async def while_radio_runs(step):
+        # The queue is bounded: once run() has died (HciError, HciTimeout)
+        # nothing drains it, so every wait also watches the radio task
+        step = asyncio.ensure_future(step)
+        done, _ = await asyncio.wait({step, radio}, return_when=asyncio.FIRST_COMPLETED)
+        if step in done:
+            return step.result()
+        step.cancel()
+        radio.result()  # re-raises what stopped the radio
+        raise RuntimeError("radio stopped before all keys were queued")
 
-    for index, byte in enumerate(data_to_send):
-        send_data_once_blocking(byte, index)
-        time.sleep(0.1)  # Delay between bytes if needed
+    for data_to_send, current_msg_id in zip(b_Data, msg_ids):
+        current_msg_id = int(current_msg_id)
 
+        print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
+        print("Sending row number", current_msg_id)
+
+        for index, byte in enumerate(data_to_send):
+            print(f"Sending byte {index}: {byte:02x}")
+            key = await scheduler.search(set_addr_and_payload_for_byte, index, current_msg_id, byte, key_cache)
+            deadline = time.monotonic() + KEY_DEADLINE if KEY_DEADLINE is not None else None
+            if repetition is not None:
+                # Positions that historically get lost are sent more often
+                repeats, dwell = repetition.plan(index)
+            else:
+                repeats, dwell = REPEAT_KEY_TIMES, ADVERTISING_DWELL
+            await while_radio_runs(scheduler.put(TransmitJob(key, dwell, repeats, deadline)))
+        print("Current message id", current_msg_id)
 
-def run_hci_cmd(cmd, hci="hci0", wait=1):
-    cmd_ = ["hcitool", "-i", hci, "cmd"]
-    cmd_ += cmd
-    print(cmd_)
-    subprocess.run(cmd_)
-    if wait > 0:
-        time.sleep(wait)
+    await while_radio_runs(scheduler.close())
+    return await radio
 
 
 def start_advertising(key, interval_ms=20):
-    addr = bytearray(key[:6])
-    addr[0] |= 0b11000000
-
-    adv = advertisement_template()
-    adv[7:29] = key[6:28]
-    adv[29] = key[0] >> 6
+    addr = advertising_address(key)
+    adv = advertisement_data(key)
 
     print(f"key     ({len(key):2}) {key.hex()}")
     print(f"address ({len(addr):2}) {addr.hex()}")
     print(f"payload ({len(adv):2}) {adv.hex()}")
 
-    # Set BLE address
-    run_hci_cmd(["0x3f", "0x001"] + bytes_to_strarray(addr, with_prefix=True)[::-1])
-    subprocess.run(["systemctl", "restart", "bluetooth"])
-    time.sleep(1)
-
-    # Set BLE advertisement payload
-    run_hci_cmd(["0x08", "0x0008"] + [format(len(adv), "x")] + bytes_to_strarray(adv))
-
-    # Set BLE advertising mode
-    interval_enc = struct.pack("<h", interval_ms)
-    hci_set_adv_params = ["0x08", "0x0006"]
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += ["03", "00", "00", "00", "00", "00", "00", "00", "00"]
-    hci_set_adv_params += ["07", "00"]
-    run_hci_cmd(hci_set_adv_params)
+    # Pre-packed HCI commands over a persistent socket instead of hcitool;
+    # each returns on the controller's completion event, then the key dwells
+    advertiser.start(key, interval_ms)
 
-    # Start BLE advertising
-    run_hci_cmd(["0x08", "0x000a"] + ["01"], wait=1)
-
-# Function to convert hex to ASCII
-def hex_to_ascii(hex_string):
-    try:
-        # Ensure the hex string has an even length
-        if len(hex_string) % 2 != 0:
-            raise ValueError("Hex string must have an even number of digits.")
-        
-        # Convert hex to bytes, then decode to ASCII
-        return bytes.fromhex(hex_string).decode('ascii')
-    except ValueError as e:
-        return f"Error: {e}"
-    except UnicodeDecodeError:
-        return "Error: The hex string cannot be decoded to ASCII."
 def load_last_processed_timestamp():
     try:
         with open('/home/lab/Desktop/last_processed_timestamp.txt', 'r') as f:
@@ -199,44 +186,65 @@ def save_last_processed_timestamp(timestamp):
         f.write(str(timestamp))
 
 
+DATA_COLUMNS = ['Data_1', 'Data_2', 'Data_3', 'Data_4', 'Data_5']
+
+
 def main(args):
-    df = pd.read_csv('/home/lab/Desktop/Sara-old/Desktop/test2_data.csv', usecols=['Timestamp', 'Data_1','Data_2','Data_3','Data_4','Data_5'])
-    df['Data_1'] = df['Data_1'].astype(str)
-    df['Data_2'] = df['Data_2'].astype(str)
-    df['Data_3'] = df['Data_3'].astype(str)
-    df['Data_4'] = df['Data_4'].astype(str)
-    df['Data_5'] = df['Data_5'].astype(str)
-    
-    df['Data_1_ascii'] = df['Data_1'].apply(hex_to_ascii)
-    df['Data_2_ascii'] = df['Data_2'].apply(hex_to_ascii)
-    df['Data_3_ascii'] = df['Data_3'].apply(hex_to_ascii)
-    df['Data_4_ascii'] = df['Data_4'].apply(hex_to_ascii)
-    df['Data_5_ascii'] = df['Data_5'].apply(hex_to_ascii)
-    df['Full_data'] = df['Data_1_ascii'] + df['Data_2_ascii'] + df['Data_3_ascii'] + df['Data_4_ascii'] + df['Data_5_ascii']
-    # Create 'full data' column by concatenating Data_1 to Data_5
-    
-    df['Full_data'] = df['Full_data'].astype('object')
+    exporter = Exporter.to_directory(METRICS_DIR, "exp_i_2")
+    key_cache = KeyCache(KEY_CACHE_PATH)
+    df = pd.read_csv('/home/lab/Desktop/Sara-old/Desktop/test2_data.csv', usecols=['Timestamp'] + DATA_COLUMNS, dtype=str)
+
+    # All five hex columns decoded in bulk into one buffer with row offsets
+    hex_rows = decode_hex_columns([df[column] for column in DATA_COLUMNS])
+    if not hex_rows.valid.all():
+        print("Skipping rows with invalid hex:", hex_rows.invalid_indices())
 
     # Filter rows with new data since the last processed timestamp
     #if last_processed_timestamp:
      #   new_data = df[df['Timestamp'] > last_processed_timestamp]
     #else:
       #  new_data = df
-    new_data = df
-    
-    data_values = new_data['Full_data'].values
-    b_Data = np.array([s.encode('utf-8') for s in data_values])
-    current_msg_id = 0
-    for i in range(len(b_Data)):
-        data_to_send = b_Data[i]
-        
-        print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
-        print("Sending row number", i)
+    #new_data = df
+
+    b_Data = hex_rows.valid_rows()
+    # msg_id is the CSV row index, so rows skipped as invalid leave a gap
+    # instead of shifting every later row and the fetch side can map
+    # messages back to rows
+    msg_ids = np.flatnonzero(hex_rows.valid)
+    # Rows are framed one CSV read at a time and flushed at its end, so no
+    # row waits on later rows and there is no latency bound to enforce
+    packer = SegmentPacker() if FRAME_ROWS else None
+    if packer is not None:
+        b_Data = list(packer.pack(b_Data))
+    if FEC_PARITY:
+        # Reed-Solomon parity messages after every FEC_DATA messages
+        b_Data = list(encode_blocks(b_Data, FEC_DATA, FEC_PARITY))
+        # Headers, padding and parity contain 0x00 bytes, and the fetch side
+        # ends a message at the first one
+        b_Data = [cobs.encode(message) for message in b_Data]
+    if packer is not None or FEC_PARITY:
+        # Segments and FEC blocks no longer match rows one to one (and a
+        # block needs consecutive msg_ids), so messages are numbered in order
+        msg_ids = range(len(b_Data))
+
+    repetition = None
+    if FETCH_RESULTS is not None:
+        repetition = RepetitionController.from_file(FETCH_RESULTS, FETCH_RESULTS_FORMAT, target=DELIVERY_TARGET,
+                                                    default_repeats=REPEAT_KEY_TIMES, dwell=ADVERTISING_DWELL,
+                                                    max_dwell=MAX_ADVERTISING_DWELL)
+        print("Repeats, dwell per position:", repetition.stats())
 
-    # Send data one byte at a time
-        send_data(data_to_send, current_msg_id)
-        current_msg_id += 1
-        print("Current message id", current_msg_id)
+    try:
+        print("Scheduler:", asyncio.run(transmit_rows(b_Data, msg_ids, key_cache, repetition)))
+    finally:
+        # Left on, the next run's first address change is disallowed
+        advertiser.stop()
+    if packer is not None:
+        print("Framing:", packer.stats())
+    print("Key cache:", key_cache.stats())
+    key_cache.close()
+    if exporter is not None:
+        exporter.close()
 
     
 
@@ -6,50 +6,31 @@ import time
 import struct
 import argparse
 import sys
-from ecdsa.keys import VerifyingKey
-from ecdsa.curves import NIST224p
+from tagalong.keysearch import is_valid_key
+from tagalong.keycache import KeyCache
+from tagalong.metrics import Exporter
+from tagalong.profiling import run_main
+from tagalong.hci import open_transport
+from tagalong.advertiser import Advertiser, ExtendedAdvertiser, advertising_address, advertisement_data
+from tagalong.pipeline import TransmitPipeline
+from tagalong.fanout import AdapterFanout
+from tagalong.framing import SegmentPacker
+from tagalong import cobs
+from tagalong.fec import encode_blocks
+from tagalong.schema import Schema, DeltaTime, Fixed16, UInt8
+from tagalong.sparse import SparseEncoder
 import pandas as pd
 import numpy as np
 
-def advertisement_template():
-    adv = ""
-    adv += "1e"  # length (30)
-    adv += "ff"  # manufacturer specific data
-    adv += "4c00"  # company ID (Apple)
-    adv += "1219"  # offline finding type and length
-    adv += "00"  # state
-    for _ in range(22):  # key[6:28]
-        adv += "00"
-    adv += "00"  # first two bits of key[0]
-    adv += "00"  # hint
-    return bytearray.fromhex(adv)
-
-
-def bytes_to_strarray(bytes_, with_prefix=False):
-    if with_prefix:
-        return [hex(b) for b in bytes_]
-    else:
-        return [format(b, "x") for b in bytes_]
-
-
 def is_valid_pubkey(public_key, valid_key_counter=0):  # Check if the compressed public key is valid
-    temp_pub_key = bytearray(29)
-    temp_pub_key[0] = 0x02
-
     counter_bytes = valid_key_counter.to_bytes(2, 'big')
     public_key[6:8] = counter_bytes
 
-    temp_pub_key[1:] = public_key
-    try:
-        VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-    except:
+    if not is_valid_key(public_key):
         return False
-    else:
-        print("valid key!")
-        vk = VerifyingKey.from_string(bytes(temp_pub_key), curve=NIST224p)
-        pub_key = vk.to_string('uncompressed')
-        print(bytearray.fromhex(public_key.hex()))
-        return True
+    print("valid key!")
+    print(bytearray.fromhex(public_key.hex()))
+    return True
 
 
 
@@ -62,6 +43,30 @@ def copy_4b_big_endian(dst, src):
 
 start_addr = [0] * 16  # Example start address
 curr_addr = start_addr.copy()
+KEY_CACHE_PATH = None  # valid counters persist across runs; None: ~/.cache/tagalong/key_cache.sqlite
+ROTATE_ADDRESS = True  # LE random address per key instead of vendor BD address + bluetoothd restart
+ADVERTISING_DWELL = 1.0  # seconds each start_advertising() keeps the key on air
+EXTENDED_ADV_SETS = 0  # >0: keep that many consecutive keys on air at once (BT5 extended advertising)
+METRICS_DIR = None  # e.g. /var/lib/node_exporter/textfile_collector: <script>.prom and .json, rewritten every 15 s
+ADAPTERS = None  # "all" or e.g. ["hci0", "hci1"]: spread messages over several HCI adapters
+
+
+def make_advertiser(hci):
+    if EXTENDED_ADV_SETS:
+        return ExtendedAdvertiser(open_transport(hci), EXTENDED_ADV_SETS, dwell=ADVERTISING_DWELL)
+    return Advertiser(open_transport(hci), rotate=ROTATE_ADDRESS, dwell=ADVERTISING_DWELL)
+
+
+advertiser = make_advertiser("hci0")
+KEY_LOOKAHEAD = 8  # keys the search stage may run ahead of the radio
+REPEAT_KEY_TIMES = 5  # start_advertising() calls per key
+# Binary records instead of UTF-8 text, e.g. Schema([DeltaTime('Timestamp'), Fixed16('Data_2', decimals=2)]);
+# they go out 0x00-free, so fetch them with FetchDecoder(stuffed=True)
+ROW_SCHEMA = None
+SPARSE_UPDATES = False  # only the bytes that changed since the previous row, with keyframes; sent 0x00-free
+FRAME_ROWS = False  # pack several short rows into each 16-byte message instead of one msg_id per row
+FEC_DATA = 8  # messages per erasure-coded block
+FEC_PARITY = 0  # >0: parity messages per block; any FEC_DATA of a block recover it; sent 0x00-free
 
 
 # Constants
@@ -75,7 +80,7 @@ modem_id_bytes = modem_id.to_bytes(4, byteorder='little')
 copy_4b_big_endian(modem_bytearray, modem_id_bytes)
 
 
-def set_addr_and_payload_for_byte(index, msg_id, val):
+def set_addr_and_payload_for_byte(index, msg_id, val, key_cache):
     valid_key_counter = 0
     public_key = bytearray(28)
     public_key[0] = 0xBA  # magic value
@@ -108,70 +113,45 @@ def set_addr_and_payload_for_byte(index, msg_id, val):
 
     curr_addr[:] = public_key[12:28]
 
+    # Re-sent and restarted keys skip the counter search entirely
+    cached_key = key_cache.lookup(public_key)
+    if cached_key is not None:
+        return cached_key
+
+    search_start = time.perf_counter()
     while not is_valid_pubkey(public_key, valid_key_counter):
         print("-------------------------")
         valid_key_counter += 1
         print(valid_key_counter)
+    key_cache.store(public_key, valid_key_counter, time.perf_counter() - search_start)
 
     return public_key
 
 
-def send_data(data_to_send, msg_id):
-    #msg_id = 1  # Set a fixed msg_id
-
-    def send_data_once_blocking(byte, index):
-        print(f"Sending byte {index}: {byte:02x}")
-        key = set_addr_and_payload_for_byte(index, msg_id, byte)
-        
-        # Start advertising for the last key sent
-        for _ in range(5):
-            start_advertising(key)
-
+def data_keys(data_to_send, msg_id, key_cache):
+    # Key-generation stage: one key per byte
     for index, byte in enumerate(data_to_send):
-        send_data_once_blocking(byte, index)
-        time.sleep(0.1)  # Delay between bytes if needed
+        print(f"Sending byte {index}: {byte:02x}")
+        yield set_addr_and_payload_for_byte(index, msg_id, byte, key_cache)
 
 
-def run_hci_cmd(cmd, hci="hci0", wait=1):
-    cmd_ = ["hcitool", "-i", hci, "cmd"]
-    cmd_ += cmd
-    print(cmd_)
-    subprocess.run(cmd_)
-    if wait > 0:
-        time.sleep(wait)
+def send_key(key):
+    # Radio stage: advertise the key, then move on to the next one
+    for _ in range(REPEAT_KEY_TIMES):
+        start_advertising(key)
 
 
 def start_advertising(key, interval_ms=20):
-    addr = bytearray(key[:6])
-    addr[0] |= 0b11000000
-
-    adv = advertisement_template()
-    adv[7:29] = key[6:28]
-    adv[29] = key[0] >> 6
+    addr = advertising_address(key)
+    adv = advertisement_data(key)
 
     print(f"key     ({len(key):2}) {key.hex()}")
     print(f"address ({len(addr):2}) {addr.hex()}")
     print(f"payload ({len(adv):2}) {adv.hex()}")
 
-    # Set BLE address
-    run_hci_cmd(["0x3f", "0x001"] + bytes_to_strarray(addr, with_prefix=True)[::-1])
-    subprocess.run(["systemctl", "restart", "bluetooth"])
-    time.sleep(1)
-
-    # Set BLE advertisement payload
-    run_hci_cmd(["0x08", "0x0008"] + [format(len(adv), "x")] + bytes_to_strarray(adv))
-
-    # Set BLE advertising mode
-    interval_enc = struct.pack("<h", interval_ms)
-    hci_set_adv_params = ["0x08", "0x0006"]
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += bytes_to_strarray(interval_enc)
-    hci_set_adv_params += ["03", "00", "00", "00", "00", "00", "00", "00", "00"]
-    hci_set_adv_params += ["07", "00"]
-    run_hci_cmd(hci_set_adv_params)
-
-    # Start BLE advertising
-    run_hci_cmd(["0x08", "0x000a"] + ["01"], wait=1)
+    # Pre-packed HCI commands over a persistent socket instead of hcitool;
+    # each returns on the controller's completion event, then the key dwells
+    advertiser.start(key, interval_ms)
 
 
 def load_last_processed_timestamp():
@@ -188,6 +168,8 @@ def save_last_processed_timestamp(timestamp):
 
 
 def main(args):
+    exporter = Exporter.to_directory(METRICS_DIR, "send_csv_data")
+    key_cache = KeyCache(KEY_CACHE_PATH)
     # Example: data_to_send = b'\x01\x02\x03\x04' (Data to send)
     #data_to_send = b'SPA'
     #last_processed_timestamp = load_last_processed_timestamp()
@@ -199,22 +181,70 @@ def main(args):
     #else:
     #    new_data = df
     new_data = df
-    data_values = new_data['Data_2'].values
-    b_Data = np.array([s.encode('utf-8') for s in data_values])
-    current_msg_id = 0
-    for i in range(len(b_Data)):
-        data_to_send = b_Data[i]
-        
-        print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
-        print("Sending row number", i)
-
-    # Send data one byte at a time
-        send_data(data_to_send, current_msg_id)
-        current_msg_id += 1
-        print("Current message id", current_msg_id)
+    if ROW_SCHEMA is not None:
+        b_Data = ROW_SCHEMA.encoder().pack_rows(new_data)
+    else:
+        data_values = new_data['Data_2'].values
+        b_Data = np.array([s.encode('utf-8') for s in data_values])
+
+    sparse = SparseEncoder() if SPARSE_UPDATES else None
+    if sparse is not None:
+        b_Data = [sparse.encode(row) for row in b_Data]
+    # Rows are framed one CSV read at a time and flushed at its end, so no
+    # row waits on later rows and there is no latency bound to enforce
+    packer = SegmentPacker() if FRAME_ROWS else None
+    if packer is not None:
+        b_Data = list(packer.pack(b_Data))
+    if FEC_PARITY:
+        # Reed-Solomon parity messages after every FEC_DATA messages
+        b_Data = list(encode_blocks(b_Data, FEC_DATA, FEC_PARITY))
+    if ROW_SCHEMA is not None or sparse is not None or FEC_PARITY:
+        # Binary records, deltas and FEC blocks contain 0x00 bytes, and the
+        # fetch side ends a message at the first one
+        b_Data = [cobs.encode(message) for message in b_Data]
+
+    def row_keys():
+        current_msg_id = 0
+        for i in range(len(b_Data)):
+            data_to_send = b_Data[i]
+
+            print("Bytes:", ' '.join([f"{byte:02x}" for byte in data_to_send]))
+            print("Sending row number", i)
+
+            # Send data one byte at a time
+            yield from data_keys(data_to_send, current_msg_id, key_cache)
+            current_msg_id += 1
+            print("Current message id", current_msg_id)
+
+    if ADAPTERS:
+        # Whole messages go to whichever adapter is free, all radios on air at once
+        names = None if ADAPTERS == "all" else ADAPTERS
+        with AdapterFanout.for_adapters(make_advertiser, names) as fanout:
+            for msg_id, data_to_send in enumerate(b_Data):
+                adapter = fanout.submit(data_keys(data_to_send, msg_id, key_cache), repeats=REPEAT_KEY_TIMES)
+                print("Sending row number", msg_id, "on", adapter)
+        print("Fan-out:", fanout.stats())
+    else:
+        # Keys for the next bytes (and rows) are searched while the radio dwells
+        pipeline = TransmitPipeline(send_key, KEY_LOOKAHEAD)
+        try:
+            pipeline.run(row_keys())
+        finally:
+            # Left on, the next run's first address change is disallowed
+            advertiser.stop()
+        print("Pipeline:", pipeline.stats())
+    if sparse is not None:
+        print("Sparse updates:", sparse.stats())
+    if packer is not None:
+        print("Framing:", packer.stats())
+    print("Key cache:", key_cache.stats())
+    key_cache.close()
+    if exporter is not None:
+        exporter.close()
 
     
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    # --profile PREFIX writes PREFIX.pstats and PREFIX.collapsed for one run
+    run_main(main, sys.argv[1:])
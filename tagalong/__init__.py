@@ -0,0 +1 @@
+"""Shared building blocks for the TagAlong Raspberry Pi senders."""
@@ -0,0 +1,257 @@
+"""Offline-finding advertisements for TagAlong keys over an HCI transport."""
+
+import struct
+import subprocess
+import time
+
+from tagalong import metrics
+from tagalong.hci import OGF_LE, OGF_VENDOR, HciError
+
+# Command OCFs
+OCF_VENDOR_SET_BDADDR = 0x001  # Broadcom/Cypress write BD address
+OCF_LE_SET_RANDOM_ADDR = 0x0005
+OCF_LE_SET_ADV_PARAMS = 0x0006
+OCF_LE_SET_ADV_DATA = 0x0008
+OCF_LE_SET_ADV_ENABLE = 0x000a
+OCF_LE_SET_ADV_SET_RANDOM_ADDR = 0x0035
+OCF_LE_SET_EXT_ADV_PARAMS = 0x0036
+OCF_LE_SET_EXT_ADV_DATA = 0x0037
+OCF_LE_SET_EXT_ADV_ENABLE = 0x0039
+OCF_LE_READ_NUM_ADV_SETS = 0x003b
+
+ADV_NONCONN_IND = 0x03
+OWN_ADDR_PUBLIC = 0x00
+OWN_ADDR_RANDOM = 0x01
+CHANNEL_MAP_ALL = 0x07
+EXT_ADV_PROPS_LEGACY_NONCONN = 0x0010  # legacy PDUs, ADV_NONCONN_IND
+EXT_ADV_DATA_COMPLETE = 0x03
+
+# Advertising intervals are in 0.625 ms units on the wire
+INTERVAL_UNIT_MS = 0.625
+LEGACY_INTERVAL_MIN = 0x0020  # 20 ms
+LEGACY_INTERVAL_NONCONN_V4 = 0x00A0  # 100 ms, non-connectable on Bluetooth 4.x
+LEGACY_INTERVAL_MAX = 0x4000
+EXT_INTERVAL_MIN = 0x000020  # 20 ms
+EXT_INTERVAL_MAX = 0xFFFFFF
+
+
+def advertising_address(key):
+    addr = bytearray(key[:6])
+    addr[0] |= 0b11000000
+    return bytes(addr)
+
+
+def advertisement_data(key):
+    adv = bytearray.fromhex("1eff4c00121900")  # length, manufacturer data, Apple, offline finding, state
+    adv += key[6:28]
+    adv.append(key[0] >> 6)  # first two bits of key[0]
+    adv.append(0x00)  # hint
+    return bytes(adv)
+
+
+def interval_units(interval_ms, lo, hi):
+    """interval_ms in 0.625 ms units, clamped to the command's valid range."""
+    return max(lo, min(hi, round(interval_ms / INTERVAL_UNIT_MS)))
+
+
+def adv_params(interval_ms, own_addr_type=OWN_ADDR_PUBLIC, min_units=LEGACY_INTERVAL_MIN):
+    interval_enc = struct.pack("<H", interval_units(interval_ms, min_units, LEGACY_INTERVAL_MAX))
+    return (interval_enc + interval_enc
+            + bytes([ADV_NONCONN_IND, own_addr_type, 0x00]) + bytes(6)
+            + bytes([CHANNEL_MAP_ALL, 0x00]))
+
+
+def ext_adv_params(handle, interval_ms, own_addr_type=OWN_ADDR_RANDOM):
+    interval_enc = interval_units(interval_ms, EXT_INTERVAL_MIN, EXT_INTERVAL_MAX).to_bytes(3, 'little')
+    return (bytes([handle]) + struct.pack("<H", EXT_ADV_PROPS_LEGACY_NONCONN)
+            + interval_enc + interval_enc
+            + bytes([CHANNEL_MAP_ALL, own_addr_type, 0x00]) + bytes(6)
+            + bytes([0x00, 0x7f, 0x01, 0x00, 0x01, handle, 0x00]))  # filter, tx power, PHYs, SID, notify
+
+
+def ext_adv_enable(enable, handles):
+    params = bytes([enable, len(handles)])
+    for handle in handles:
+        params += bytes([handle]) + bytes(3)  # no duration or event limit
+    return params
+
+
+def restart_bluetoothd():
+    subprocess.run(["systemctl", "restart", "bluetooth"])
+
+
+class Advertiser:
+    """Legacy advertising of one key at a time.
+
+    By default the key's address is written as the public BD address with
+    the vendor command, which only takes effect after bluetoothd restarts.
+    With rotate=True it is set as the LE random static address instead:
+    advertising is disabled, the address and data are replaced and
+    advertising is enabled again, with no daemon restart. The first
+    rotation always disables advertising, since a previous run that
+    never called stop() leaves the controller advertising and the
+    address change would fail with Command Disallowed; call stop() when
+    done.
+
+    Each command returns once the controller has completed it, so there
+    are no fixed sleeps between commands. After enabling, start() keeps
+    the key on air for dwell seconds. restart_wait only applies to the
+    bluetoothd restart of the vendor address path.
+
+    The vendor address write only exists on Broadcom/Cypress controllers;
+    elsewhere it fails and, as with the hcitool scripts, advertising goes
+    on with the controller's own address (vendor_errors counts these).
+    Use min_interval=LEGACY_INTERVAL_NONCONN_V4 on Bluetooth 4.x
+    controllers, which reject non-connectable intervals under 100 ms.
+    """
+
+    def __init__(self, transport, restart=restart_bluetoothd, restart_wait=1.0, command_wait=0.0,
+                 rotate=False, dwell=0.0, sleep=time.sleep, min_interval=LEGACY_INTERVAL_MIN):
+        self.transport = transport
+        self.restart = restart
+        self.restart_wait = restart_wait
+        self.command_wait = command_wait
+        self.rotate = rotate
+        self.dwell = dwell
+        self.sleep = sleep
+        self.min_interval = min_interval
+        self.vendor_errors = 0
+        self._advertising = None  # unknown until the first enable or disable
+        self._interval_ms = None  # advertising parameters currently set (rotate mode)
+
+    def _command(self, ocf, params, ogf=OGF_LE):
+        ret = self.transport.send_command(ogf, ocf, params)
+        if self.command_wait > 0:
+            self.sleep(self.command_wait)
+            metrics.SLEEP_SECONDS.inc(self.command_wait)
+        return ret
+
+    def start(self, key, interval_ms=20):
+        self.load(key, interval_ms)
+        if self.dwell > 0:
+            self.sleep(self.dwell)
+            metrics.DWELL_SECONDS.inc(self.dwell)
+
+    def load(self, key, interval_ms=20):
+        """Put key on air and return without dwelling."""
+        metrics.KEYS_ADVERTISED.inc()
+        if self.rotate:
+            self._start_rotating(key, interval_ms)
+        else:
+            self._start_restarting(key, interval_ms)
+
+    def _start_restarting(self, key, interval_ms):
+        # Set BLE address (little endian on the wire)
+        try:
+            self._command(OCF_VENDOR_SET_BDADDR, advertising_address(key)[::-1], ogf=OGF_VENDOR)
+        except HciError as e:
+            if not self.vendor_errors:
+                print(f"Vendor BD address write failed, advertising with the controller address: {e}")
+            self.vendor_errors += 1
+        if self.restart is not None:
+            self.restart()
+            self.sleep(self.restart_wait)
+            metrics.SLEEP_SECONDS.inc(self.restart_wait)
+
+        adv = advertisement_data(key)
+        self._command(OCF_LE_SET_ADV_DATA, bytes([len(adv)]) + adv)
+        self._command(OCF_LE_SET_ADV_PARAMS, adv_params(interval_ms, OWN_ADDR_PUBLIC, self.min_interval))
+        self._command(OCF_LE_SET_ADV_ENABLE, b"\x01")
+        self._advertising = True
+
+    def _start_rotating(self, key, interval_ms):
+        # The random address can only change while advertising is off
+        self.stop()
+        self._command(OCF_LE_SET_RANDOM_ADDR, advertising_address(key)[::-1])
+        adv = advertisement_data(key)
+        self._command(OCF_LE_SET_ADV_DATA, bytes([len(adv)]) + adv)
+        if interval_ms != self._interval_ms:
+            self._command(OCF_LE_SET_ADV_PARAMS, adv_params(interval_ms, OWN_ADDR_RANDOM, self.min_interval))
+            self._interval_ms = interval_ms
+        self._command(OCF_LE_SET_ADV_ENABLE, b"\x01")
+        self._advertising = True
+
+    def stop(self):
+        # Disabling is harmless when advertising is already off
+        if self._advertising is not False:
+            self._command(OCF_LE_SET_ADV_ENABLE, b"\x00")
+            self._advertising = False
+
+
+class ExtendedAdvertiser:
+    """Keeps several keys on air at once with LE extended advertising sets.
+
+    Each set has its own random address, so a BT5 controller advertises
+    num_sets consecutive keys concurrently. start() has the same contract
+    as Advertiser.start(): the key is loaded into the least recently used
+    set (unless it is already on air) and the call returns after
+    dwell / num_sets. A stream of keys therefore slides through the sets
+    and each key still gets about dwell seconds of airtime, while keys are
+    consumed num_sets times faster.
+    """
+
+    def __init__(self, transport, num_sets=4, dwell=0.0, sleep=time.sleep):
+        self.transport = transport
+        self.requested_sets = num_sets
+        self.dwell = dwell
+        self.sleep = sleep
+        self.num_sets = None
+        self._interval_ms = None
+        self._on_air = {}  # handle -> key
+        self._last_used = {}  # handle -> push count
+        self._pushes = 0
+
+    def _command(self, ocf, params):
+        return self.transport.send_command(OGF_LE, ocf, params)
+
+    def _setup(self, interval_ms):
+        if self.num_sets is None:
+            supported = self._command(OCF_LE_READ_NUM_ADV_SETS, b"")[1]
+            self.num_sets = max(1, min(self.requested_sets, supported))
+            # Sets left enabled by a previous run reject new parameters
+            self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(0, []))
+        for handle in range(self.num_sets):
+            if handle in self._on_air:
+                self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(0, [handle]))
+            self._command(OCF_LE_SET_EXT_ADV_PARAMS, ext_adv_params(handle, interval_ms))
+            if handle in self._on_air:
+                self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(1, [handle]))
+        self._interval_ms = interval_ms
+
+    def _load(self, handle, key):
+        if handle in self._on_air:
+            self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(0, [handle]))
+        self._command(OCF_LE_SET_ADV_SET_RANDOM_ADDR, bytes([handle]) + advertising_address(key)[::-1])
+        adv = advertisement_data(key)
+        self._command(OCF_LE_SET_EXT_ADV_DATA, bytes([handle, EXT_ADV_DATA_COMPLETE, 0x01, len(adv)]) + adv)
+        self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(1, [handle]))
+        self._on_air[handle] = bytes(key)
+
+    def start(self, key, interval_ms=20):
+        self.load(key, interval_ms)
+        if self.dwell > 0:
+            self.sleep(self.dwell / self.num_sets)
+            metrics.DWELL_SECONDS.inc(self.dwell / self.num_sets)
+
+    def load(self, key, interval_ms=20):
+        """Put key into a set (if not already on air) without dwelling."""
+        metrics.KEYS_ADVERTISED.inc()
+        if interval_ms != self._interval_ms:
+            self._setup(interval_ms)
+        key = bytes(key)
+        handle = next((h for h, k in self._on_air.items() if k == key), None)
+        if handle is None:
+            free = [h for h in range(self.num_sets) if h not in self._on_air]
+            handle = free[0] if free else min(self._last_used, key=self._last_used.get)
+            self._load(handle, key)
+        self._pushes += 1
+        self._last_used[handle] = self._pushes
+
+    def on_air(self):
+        """Keys currently advertised, by set handle."""
+        return dict(self._on_air)
+
+    def stop(self):
+        if self._on_air:
+            self._command(OCF_LE_SET_EXT_ADV_ENABLE, ext_adv_enable(0, []))  # disables every set
+            self._on_air.clear()
@@ -0,0 +1,54 @@
+"""Vectorised chunk planning for one message.
+
+plan_chunks() does in a few NumPy passes what send_data_once_blocking and
+set_addr_and_payload_for_byte do chunk by chunk: split the payload into
+LSB-first chunk_len bit values, work out where each one lands in the 16
+byte key body and XOR-accumulate the body after every chunk.
+"""
+
+import numpy as np
+
+BODY_LEN = 16
+
+
+class ChunkPlan:
+    def __init__(self, values, start_bytes, offsets, spills, bodies):
+        self.values = values  # chunk values
+        self.start_bytes = start_bytes  # body byte index (from the end) of each chunk's low bits
+        self.offsets = offsets  # bit offset within that byte
+        self.spills = spills  # chunk continues into the next byte
+        self.bodies = bodies  # (n, 16) uint8: key[12:28] after each chunk
+
+    def __len__(self):
+        return len(self.values)
+
+
+def chunk_values(payload, chunk_len):
+    data = np.frombuffer(bytes(payload), dtype=np.uint8)
+    n = (len(data) * 8 + chunk_len - 1) // chunk_len
+    bits = np.unpackbits(data, bitorder='little')
+    bits = np.concatenate([bits, np.zeros(n * chunk_len - len(bits), dtype=np.uint8)])
+    weights = (1 << np.arange(chunk_len)).astype(np.uint16)
+    return bits.reshape(n, chunk_len).astype(np.uint16) @ weights
+
+
+def plan_chunks(payload, chunk_len, start_body=None):
+    if not 1 <= chunk_len <= 8:
+        raise ValueError("chunk_len must be between 1 and 8")
+    values = chunk_values(payload, chunk_len)
+    n = len(values)
+    bit_index = np.arange(n) * chunk_len
+    start_bytes = (bit_index // 8) % BODY_LEN
+    offsets = bit_index % 8
+    spills = (8 - offsets) < chunk_len
+
+    rows = np.arange(n)
+    deltas = np.zeros((n, BODY_LEN), dtype=np.uint8)
+    deltas[rows, BODY_LEN - 1 - start_bytes] = (values << offsets) & 0xFF
+    next_bytes = (start_bytes[spills] + 1) % BODY_LEN
+    deltas[rows[spills], BODY_LEN - 1 - next_bytes] = values[spills] >> (8 - offsets[spills])
+    if start_body is not None and n:
+        deltas[0] ^= np.frombuffer(bytes(start_body), dtype=np.uint8)
+    bodies = np.bitwise_xor.accumulate(deltas, axis=0) if n else deltas
+
+    return ChunkPlan(values, start_bytes, offsets, spills, bodies)
@@ -0,0 +1,45 @@
+"""Consistent Overhead Byte Stuffing: a 0x00-free wire form for messages.
+
+The fetch side cannot tell a 0x00 byte from the end of a message: a zero
+chunk leaves the key unchanged, so FetchDecoder (like DataFetcher) stops
+there. Text rows never contain one, but binary records (schema, sparse
+deltas, FEC blocks) do all the time. encode() replaces every 0x00 with
+the distance to the next one, for one byte of overhead per message (plus
+one per 254 bytes); decode() undoes it. The sender stuffs its final
+messages and a FetchDecoder created with stuffed=True unstuffs them
+before they reach SchemaDecoder, SparseDecoder or FecDecoder.
+"""
+
+MAX_RUN = 0xff
+
+
+def encode(data):
+    out = bytearray([0])
+    code_at = 0
+    for byte in bytes(data):
+        if byte:
+            out.append(byte)
+        if not byte or len(out) - code_at == MAX_RUN:
+            out[code_at] = len(out) - code_at
+            code_at = len(out)
+            out.append(0)
+    out[code_at] = len(out) - code_at
+    return bytes(out)
+
+
+def decode(data):
+    """Raises ValueError for data that is not a complete stuffed message."""
+    data = bytes(data)
+    if not data:
+        raise ValueError("empty stuffed message")
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if not code or i + code > len(data):
+            raise ValueError("truncated or malformed stuffed message")
+        out += data[i + 1:i + code]
+        i += code
+        if code < MAX_RUN and i < len(data):
+            out.append(0)
+    return bytes(out)
@@ -0,0 +1,80 @@
+"""Per-byte value domains for pruning decode-side candidate lookups.
+
+Our payloads are mostly ASCII text (s.encode('utf-8'), hex_to_ascii) or
+bounded sensor fields, so most of the 2^chunk_len candidates at a
+position can never occur. ValueDomains declares the allowed values of
+each payload byte:
+
+    ValueDomains([DIGITS, DIGITS, enum("."), DIGITS], default=PRINTABLE)
+
+and turns that into the chunk values worth querying at a position, given
+the chunks already decoded (a chunk may cover part of a byte, or the end
+of one byte and the start of the next). FetchDecoder queries those first
+and falls back to the rest of the range only when none of them has
+reports.
+"""
+
+PRINTABLE = frozenset(range(0x20, 0x7f))
+DIGITS = frozenset(b"0123456789")
+NUMERIC = DIGITS | frozenset(b"+-. ")
+HEX_DIGITS = frozenset(b"0123456789abcdefABCDEF")
+ANY = None
+
+
+def value_range(lo, hi):
+    """Byte values lo..hi inclusive, e.g. a UInt8 schema field."""
+    if not 0 <= lo <= hi <= 0xFF:
+        raise ValueError("range must lie within 0..255")
+    return frozenset(range(lo, hi + 1))
+
+
+def enum(*values):
+    """Byte values given as ints, or as the bytes of str/bytes arguments."""
+    out = set()
+    for value in values:
+        if isinstance(value, str):
+            value = value.encode()
+        if isinstance(value, int):
+            value = [value]
+        out.update(value)
+    if any(not 0 <= v <= 0xFF for v in out):
+        raise ValueError("enum values must be bytes")
+    return frozenset(out)
+
+
+class ValueDomains:
+    def __init__(self, per_byte=(), default=ANY):
+        """per_byte[i] is the domain of payload byte i; bytes past the end use default.
+
+        A domain is a set of byte values, or ANY (None) for no restriction.
+        """
+        self.per_byte = [None if d is None else frozenset(d) for d in per_byte]
+        self.default = None if default is None else frozenset(default)
+
+    def domain(self, index):
+        return self.per_byte[index] if index < len(self.per_byte) else self.default
+
+    def allowed(self, values, chunk_len):
+        """Sorted chunk values for the position after `values`, or None for the full range."""
+        bit = len(values) * chunk_len
+        index, offset = divmod(bit, 8)
+        first = self.domain(index)
+        low_bits = min(chunk_len, 8 - offset)
+        high_bits = chunk_len - low_bits
+        second = self.domain(index + 1) if high_bits else None
+        if first is None and second is None:
+            return None
+
+        # Bits of the current byte below this chunk are already decoded
+        acc = 0
+        for i, value in enumerate(values):
+            acc |= value << (i * chunk_len)
+        known = (acc >> (8 * index)) & ((1 << offset) - 1)
+
+        firsts = {(x >> offset) & ((1 << low_bits) - 1)
+                  for x in (first if first is not None else range(256))
+                  if x & ((1 << offset) - 1) == known}
+        if not high_bits:
+            return sorted(firsts)
+        seconds = {y & ((1 << high_bits) - 1) for y in (second if second is not None else range(256))}
+        return sorted(lo | (hi << low_bits) for lo in firsts for hi in seconds)
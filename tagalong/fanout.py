@@ -0,0 +1,146 @@
+"""Spread messages over every local HCI adapter.
+
+Airtime, not key search, bounds throughput once keys are searched ahead,
+so a gateway with a USB dongle next to the onboard radio can send twice
+as much. AdapterFanout gives each adapter its own Advertiser (own random
+address rotation, own dwell timer) and worker thread, and shards by
+message: all keys of one msg_id go out, in order, on one adapter, so the
+XOR chain of a message never depends on two radios. A message goes to
+the adapter with the least work queued.
+
+Every adapter shares one bluetoothd, so with more than one adapter the
+advertisers must rotate random addresses: the vendor BD address path
+restarts the daemon for every key and would cut the other radios off.
+"""
+
+import os
+import queue
+import re
+import threading
+import time
+
+SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+DEFAULT_BACKLOG = 2  # messages queued per adapter
+
+_DONE = object()
+_ADAPTER = re.compile(r"^hci\d+$")
+
+
+def discover_adapters(sysfs=SYSFS_BLUETOOTH):
+    """hciN names of the local controllers, in index order."""
+    try:
+        names = [n for n in os.listdir(sysfs) if _ADAPTER.match(n)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda n: int(n[3:]))
+
+
+class _Worker:
+    def __init__(self, name, advertiser, backlog, lock):
+        self.name = name
+        self.lock = lock
+        self.advertiser = advertiser
+        self.queue = queue.Queue(maxsize=backlog)
+        self.queued_keys = 0  # keys submitted but not yet sent
+        self.keys_sent = 0
+        self.messages_sent = 0
+        self.busy_seconds = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"fanout-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            keys, repeats, interval_ms = item
+            if self.error is not None:
+                continue
+            start = time.monotonic()
+            try:
+                for key in keys:
+                    for _ in range(repeats):
+                        self.advertiser.start(key, interval_ms)
+                    self.keys_sent += 1
+                    with self.lock:
+                        self.queued_keys -= 1
+            except Exception as e:
+                self.error = e  # keep draining so close() never blocks
+                continue
+            finally:
+                self.busy_seconds += time.monotonic() - start
+            self.messages_sent += 1
+
+    def stats(self):
+        return {
+            "keys_sent": self.keys_sent,
+            "messages_sent": self.messages_sent,
+            "busy_seconds": self.busy_seconds,
+        }
+
+
+class AdapterFanout:
+    def __init__(self, advertisers, backlog=DEFAULT_BACKLOG):
+        """advertisers: mapping of adapter name to Advertiser."""
+        if not advertisers:
+            raise ValueError("no HCI adapters to send on")
+        restarting = [name for name, adv in advertisers.items()
+                      if not getattr(adv, "rotate", True) and getattr(adv, "restart", None) is not None]
+        if len(advertisers) > 1 and restarting:
+            raise ValueError(f"{', '.join(restarting)} restart the shared bluetoothd for every key; "
+                             "use rotate=True when sending on several adapters")
+        self._lock = threading.Lock()
+        self.workers = [_Worker(name, adv, backlog, self._lock) for name, adv in advertisers.items()]
+        self._started = time.monotonic()
+        self._finished = None
+
+    @classmethod
+    def for_adapters(cls, make_advertiser, names=None, backlog=DEFAULT_BACKLOG):
+        """make_advertiser(name) -> Advertiser; names default to every adapter found."""
+        names = names if names is not None else discover_adapters()
+        return cls({name: make_advertiser(name) for name in names}, backlog)
+
+    def _check(self):
+        for worker in self.workers:
+            if worker.error is not None:
+                raise RuntimeError(f"{worker.name} failed") from worker.error
+
+    def submit(self, keys, repeats=1, interval_ms=20):
+        """Queue one message's keys on the least loaded adapter; blocks when all are full."""
+        self._check()
+        keys = list(keys)
+        with self._lock:
+            worker = min(self.workers, key=lambda w: w.queued_keys)
+            worker.queued_keys += len(keys)
+        worker.queue.put((keys, repeats, interval_ms))
+        return worker.name
+
+    def close(self):
+        if self._finished is not None:
+            return
+        for worker in self.workers:
+            worker.queue.put(_DONE)
+        for worker in self.workers:
+            worker.thread.join()
+            if worker.error is None:
+                worker.advertiser.stop()
+        self._finished = time.monotonic()
+        self._check()
+
+    def stats(self):
+        elapsed = (self._finished or time.monotonic()) - self._started
+        keys = sum(w.keys_sent for w in self.workers)
+        return {
+            "adapters": len(self.workers),
+            "keys_sent": keys,
+            "messages_sent": sum(w.messages_sent for w in self.workers),
+            "keys_per_second": keys / elapsed if elapsed else 0.0,
+            "per_adapter": {w.name: w.stats() for w in self.workers},
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
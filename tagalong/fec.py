@@ -0,0 +1,167 @@
+"""Erasure coding across messages.
+
+A lost key breaks the XOR chain of its message, so the unit of loss on
+the fetch side is a whole message. Instead of repeating every key N
+times, encode_blocks() groups k segments into a block and appends m
+parity messages of a systematic Reed-Solomon (Cauchy) code over GF(256);
+any k of the k + m messages of a block rebuild all k segments.
+
+Each message is [header] [symbol...]. The header holds k - 1 in the high
+nibble and the message's index in the block (data first, then parity) in
+the low nibble, so a block has at most 16 messages and consecutive
+msg_ids. The symbol is [segment length] segment, zero-padded to the
+longest segment of the block. Parity row i uses the coefficients
+1 / (x_i + y_j) with x_i = 0x80 + i and y_j = j, which do not depend on
+k or m, so the decoder needs nothing beyond the header.
+
+Headers (0x00 for a one-segment block), padding and parity bytes are
+0x00 all the time, so messages go out through cobs.encode and are
+fetched with FetchDecoder(stuffed=True). decode_block() still pads
+shorter messages back to the block width, so a lost trailing 0x00 costs
+nothing: the length byte trims every segment.
+"""
+
+import numpy as np
+
+MAX_BLOCK = 16
+DEFAULT_DATA = 8
+DEFAULT_PARITY = 4
+
+# GF(256), polynomial x^8 + x^4 + x^3 + x^2 + 1
+_EXP = np.zeros(512, dtype=np.int64)
+_LOG = np.zeros(256, dtype=np.int64)
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+_EXP[255:510] = _EXP[:255]
+
+# MUL[a] is the "multiply by a" lookup table
+MUL = np.zeros((256, 256), dtype=np.uint8)
+MUL[1:, 1:] = _EXP[(_LOG[1:, None] + _LOG[None, 1:]) % 255]
+
+
+def gf_inv(a):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(_EXP[255 - _LOG[a]])
+
+
+def coefficient_row(index, k):
+    """Generator row for message index of a block with k data segments."""
+    if index < k:
+        row = np.zeros(k, dtype=np.uint8)
+        row[index] = 1
+        return row
+    x = 0x80 + index - k
+    return np.array([gf_inv(x ^ j) for j in range(k)], dtype=np.uint8)
+
+
+def _combine(coefficients, symbols):
+    out = np.zeros(symbols.shape[1], dtype=np.uint8)
+    for c, symbol in zip(coefficients, symbols):
+        if c:
+            out ^= MUL[c][symbol]
+    return out
+
+
+def encode_block(segments, parity=DEFAULT_PARITY):
+    """k segments -> k + parity messages."""
+    k = len(segments)
+    if k < 1 or k + parity > MAX_BLOCK:
+        raise ValueError(f"block of {k} + {parity} messages, at most {MAX_BLOCK}")
+    width = 1 + max(len(s) for s in segments)
+    symbols = np.zeros((k, width), dtype=np.uint8)
+    for j, segment in enumerate(segments):
+        if len(segment) > 0xff:
+            raise ValueError("segment longer than 255 bytes")
+        symbols[j, 0] = len(segment)
+        symbols[j, 1:1 + len(segment)] = np.frombuffer(bytes(segment), dtype=np.uint8)
+
+    messages = []
+    for index in range(k + parity):
+        header = bytes([(k - 1) << 4 | index])
+        symbol = symbols[index] if index < k else _combine(coefficient_row(index, k), symbols)
+        messages.append(header + symbol.tobytes())
+    return messages
+
+
+def encode_blocks(segments, data=DEFAULT_DATA, parity=DEFAULT_PARITY):
+    """Messages for all segments, data blocks of up to `data` segments."""
+    segments = list(segments)
+    for start in range(0, len(segments), data):
+        yield from encode_block(segments[start:start + data], parity)
+
+
+def _solve(rows, symbols):
+    """Gauss-Jordan elimination over GF(256); rows is k x k."""
+    rows = rows.copy()
+    symbols = symbols.copy()
+    k = len(rows)
+    for col in range(k):
+        pivot = next(r for r in range(col, k) if rows[r, col])
+        rows[[col, pivot]] = rows[[pivot, col]]
+        symbols[[col, pivot]] = symbols[[pivot, col]]
+        scale = gf_inv(int(rows[col, col]))
+        rows[col] = MUL[scale][rows[col]]
+        symbols[col] = MUL[scale][symbols[col]]
+        for r in range(k):
+            c = int(rows[r, col])
+            if r != col and c:
+                rows[r] ^= MUL[c][rows[col]]
+                symbols[r] ^= MUL[c][symbols[col]]
+    return symbols
+
+
+def parse_header(message):
+    return (message[0] >> 4) + 1, message[0] & 0x0f
+
+
+def decode_block(messages):
+    """Rebuild the data segments from any k messages of one block.
+
+    messages: iterable of received messages (any order). Returns None if
+    fewer than k distinct messages are available.
+    """
+    received = {}
+    k = None
+    for message in messages:
+        k, index = parse_header(message)
+        received[index] = np.frombuffer(bytes(message[1:]), dtype=np.uint8)
+    if k is None or len(received) < k:
+        return None
+    # Messages cut short at trailing 0x00 bytes come back zero-padded
+    width = max(len(symbol) for symbol in received.values())
+    received = {i: np.pad(symbol, (0, width - len(symbol))) for i, symbol in received.items()}
+
+    indices = sorted(received)[:k]
+    if indices == list(range(k)):
+        symbols = np.stack([received[i] for i in indices])
+    else:
+        rows = np.stack([coefficient_row(i, k) for i in indices])
+        symbols = _solve(rows, np.stack([received[i] for i in indices]))
+    return [symbol[1:1 + symbol[0]].tobytes() for symbol in symbols]
+
+
+class FecDecoder:
+    """Collects messages by msg_id and decodes each block once it can."""
+
+    def __init__(self):
+        self.blocks = {}  # first msg_id of the block -> received messages
+        self.decoded = {}  # first msg_id of the block -> segments
+
+    def add(self, msg_id, message):
+        """Returns the block's segments the first time it becomes decodable."""
+        k, index = parse_header(message)
+        first = msg_id - index
+        if first in self.decoded:
+            return None
+        self.blocks.setdefault(first, []).append(message)
+        segments = decode_block(self.blocks[first])
+        if segments is not None:
+            self.decoded[first] = segments
+            del self.blocks[first]
+        return segments
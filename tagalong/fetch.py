@@ -0,0 +1,312 @@
+"""Fetch-side decoder: recover messages from Find My report lookups.
+
+For position i of a message the decoder builds the key the sender would
+have advertised for every possible chunk value (the same XOR chain as
+schedule.key_templates, plus the counter search), hashes each with
+SHA-256 and asks a report source which of those hashed IDs have reports.
+The one that does gives the chunk value and the body for position i + 1.
+
+A message's positions depend on each other through the XOR chain, but
+messages do not, so FetchDecoder decodes all requested messages at once:
+every position is one concurrent batch of 2^chunk_len lookups, the
+batches of all messages share a bounded pool of connections, and each
+message is yielded as soon as it ends. As in DataFetcher, a message ends
+at the first 0x00 byte (past the last chunk only value 0, i.e. the last
+key again, still has reports) or where nothing has reports at all.
+Decode time is about (longest message) x (round trip) instead of the sum
+over messages and positions.
+
+Binary payloads go out 0x00-free (see cobs); with stuffed=True the
+decoder unstuffs each message and yields None for one that did not come
+through whole.
+
+Report sources implement `async fetch(hashed_ids) -> set of found ids`.
+HttpReportSource talks to StubReportServer (a local stand-in for the
+report service, for tests and benchmarks) over pooled keep-alive
+connections; MemoryReportSource skips the network.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import urllib.parse
+
+from tagalong import cobs, keysearch
+from tagalong.schedule import BODY_LEN, key_template, key_templates, modem_bytes, place_chunk
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_POOL_SIZE = 4
+DEFAULT_BATCH = 256
+
+
+def hashed_id(key):
+    """Base64 SHA-256 of the 28-byte advertised key, as the report service indexes it."""
+    return base64.b64encode(hashlib.sha256(bytes(key)).digest()).decode()
+
+
+def finish_key(template):
+    key = bytearray(template)
+    keysearch.find_valid_counter(key)
+    return key
+
+
+def candidate_keys(modem, msg_id, body, position, chunk_len, values=None):
+    """{value: key} for the chunk at position on top of body."""
+    modem = modem_bytes(modem)
+    out = {}
+    for value in values if values is not None else range(1 << chunk_len):
+        candidate = bytearray(body)
+        place_chunk(candidate, position, value, chunk_len)
+        out[value] = finish_key(key_template(modem, msg_id, candidate))
+    return out
+
+
+def candidate_ids(modem, msg_id, body, position, chunk_len, values=None):
+    """{value: hashed ID} for the chunk at position on top of body."""
+    keys = candidate_keys(modem, msg_id, body, position, chunk_len, values)
+    return {value: hashed_id(key) for value, key in keys.items()}
+
+
+def advertised_ids(modem, msg_id, data, chunk_len):
+    """Hashed IDs a sender produces for data, for seeding a stub source."""
+    modem = modem_bytes(modem)
+    return [hashed_id(finish_key(t)) for t in key_templates(modem, msg_id, data, chunk_len)]
+
+
+def values_to_bytes(values, chunk_len):
+    """Inverse of chunking.chunk_values: LSB-first chunks back into bytes."""
+    acc = 0
+    for i, value in enumerate(values):
+        acc |= value << (i * chunk_len)
+    length = len(values) * chunk_len // 8  # the last chunk may carry padding bits
+    return (acc & ((1 << (8 * length)) - 1)).to_bytes(length, 'little')
+
+
+class MemoryReportSource:
+    def __init__(self, ids=(), latency=0.0):
+        self.ids = set(ids)
+        self.latency = latency
+        self.requests = 0
+        self.lookups = 0
+
+    async def fetch(self, hashed_ids):
+        self.requests += 1
+        self.lookups += len(hashed_ids)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {i for i in hashed_ids if i in self.ids}
+
+    async def close(self):
+        pass
+
+
+class StubReportServer:
+    """POST /fetch {"ids": [...]} -> {"found": [...]}, HTTP/1.1 keep-alive."""
+
+    def __init__(self, ids=(), latency=0.0, host="127.0.0.1", port=0):
+        self.source = MemoryReportSource(ids, latency)
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/fetch"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.url
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                found = await self.source.fetch(body.get("ids", []))
+                payload = json.dumps({"found": sorted(found)}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(payload) + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+class HttpReportSource:
+    """JSON-over-HTTP client with a pool of keep-alive connections."""
+
+    def __init__(self, url, pool_size=DEFAULT_POOL_SIZE, batch=DEFAULT_BATCH):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.batch = batch
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle = []  # (reader, writer)
+        self.requests = 0
+
+    async def _request(self, ids):
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                body = json.dumps({"ids": ids}).encode()
+                writer.write(f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                             + body)
+                await writer.drain()
+                status = await reader.readline()
+                if not status.startswith(b"HTTP/1.1 200"):
+                    raise ConnectionError(f"report source answered {status.decode().strip()!r}")
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                reply = json.loads(await reader.readexactly(length))
+            except BaseException:
+                # A half-read response leaves the stream unusable; never pool it
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+            self.requests += 1
+            return set(reply["found"])
+
+    async def fetch(self, hashed_ids):
+        hashed_ids = list(hashed_ids)
+        parts = [hashed_ids[i:i + self.batch] for i in range(0, len(hashed_ids), self.batch)]
+        found = set()
+        for part in await asyncio.gather(*(self._request(p) for p in parts)):
+            found |= part
+        return found
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+            await writer.wait_closed()
+        self._idle = []
+
+
+class FetchDecoder:
+    def __init__(self, modem, chunk_len, source, concurrency=DEFAULT_CONCURRENCY, max_positions=None,
+                 start_body=bytes(BODY_LEN), candidates=candidate_ids, domains=None, stuffed=False):
+        self.modem = modem
+        self.chunk_len = chunk_len
+        self.source = source
+        self.max_positions = max_positions
+        self.start_body = bytes(start_body)
+        # (modem, msg_id, body, position, chunk_len, values=None) -> {value: hashed ID}
+        self.candidates = candidates
+        self.domains = domains  # domains.ValueDomains, or None to query every value
+        self.stuffed = stuffed  # messages were sent through cobs.encode
+        self._ids = {}  # msg_id -> {(body, position): {value: hashed ID}}, while the message decodes
+        self._lookups = asyncio.Semaphore(concurrency)
+        self.lookups = 0
+        self.ambiguous = 0  # positions where more than one value had a report
+        self.fallbacks = 0  # positions where no in-domain value had a report
+        self.malformed = 0  # stuffed messages that did not unstuff
+
+    async def _query(self, msg_id, body, position, values):
+        """Sorted values among `values` whose keys have reports."""
+        known = self._ids.setdefault(msg_id, {}).setdefault((body, position), {})
+        missing = [v for v in values if v not in known]
+        if missing:
+            loop = asyncio.get_running_loop()
+            # Candidate generation is CPU work (counter searches); keep it off the loop
+            known.update(await loop.run_in_executor(None, functools.partial(
+                self.candidates, self.modem, msg_id, body, position, self.chunk_len, values=missing)))
+        ids = {known[v]: v for v in values}
+        async with self._lookups:
+            found = await self.source.fetch(list(ids))
+        self.lookups += len(ids)
+        return sorted(ids[i] for i in found)
+
+    async def _position(self, msg_id, body, decoded):
+        position = len(decoded)
+        everything = range(1 << self.chunk_len)
+        preferred = self.domains.allowed(decoded, self.chunk_len) if self.domains is not None else None
+        if preferred is None:
+            values = await self._query(msg_id, body, position, everything)
+        else:
+            values = await self._query(msg_id, body, position, preferred)
+            # Value 0 always has reports (see below), so only another value
+            # proves the chunk was in the domain
+            if not any(values):
+                self.fallbacks += 1
+                preferred = set(preferred)
+                values = sorted(set(values) | set(await self._query(
+                    msg_id, body, position, [v for v in everything if v not in preferred])))
+        # Value 0 leaves the body unchanged, so its key is the previous
+        # position's and always has reports; like decodeReports, prefer
+        # any other value that was seen.
+        if len(values) > 1 and values[0] == 0:
+            values.pop(0)
+        if len(values) > 1:
+            self.ambiguous += 1
+        return values[0] if values else None
+
+    async def decode_message(self, msg_id):
+        """(msg_id, data) once a position has no report or a 0x00 byte completes."""
+        try:
+            data = await self._decode_message(msg_id)
+        finally:
+            # Repeated polls of a msg_id are what a KeyIndex is for
+            self._ids.pop(msg_id, None)
+        if self.stuffed:
+            try:
+                data = cobs.decode(data)
+            except ValueError:
+                self.malformed += 1
+                data = None
+        return msg_id, data
+
+    async def _decode_message(self, msg_id):
+        body = bytearray(self.start_body)
+        values = []
+        while self.max_positions is None or len(values) < self.max_positions:
+            value = await self._position(msg_id, bytes(body), values)
+            if value is None:
+                break
+            complete = len(values) * self.chunk_len // 8
+            place_chunk(body, len(values), value, self.chunk_len)
+            values.append(value)
+            if len(values) * self.chunk_len // 8 > complete:
+                data = values_to_bytes(values, self.chunk_len)
+                if data[-1] == 0:
+                    return data[:-1]
+        return values_to_bytes(values, self.chunk_len)
+
+    async def stream(self, msg_ids):
+        """Yield (msg_id, data) in completion order."""
+        for done in asyncio.as_completed([self.decode_message(m) for m in msg_ids]):
+            yield await done
+
+    async def decode(self, msg_ids):
+        return {msg_id: data async for msg_id, data in self.stream(msg_ids)}
+
+    def stats(self):
+        return {"lookups": self.lookups, "ambiguous": self.ambiguous, "fallbacks": self.fallbacks,
+                "malformed": self.malformed}
@@ -0,0 +1,126 @@
+"""Coalesce small rows into shared 16-byte segments.
+
+Every msg_id costs the fetch side 2^chunk_len queries per position, so
+spending one on a 3 byte row is wasteful. SegmentPacker frames rows as
+
+    [length] bytes...
+
+and packs as many as fit into one segment, which is then sent as one
+message. Bit 7 of the length byte marks a row that continues in the next
+segment (rows longer than a segment are split). A segment is flushed when
+it is full or when its oldest row has waited max_latency seconds;
+segments are not padded, a short one simply costs fewer keys.
+
+max_latency is only checked in add() and poll(): a sender that feeds
+rows as they arrive must also call poll() from its send loop or a timer,
+or a segment can wait indefinitely for its next row. pack() flushes at
+the end and needs neither.
+"""
+
+import time
+
+SEGMENT_SIZE = 16
+
+CONTINUES = 0x80
+LENGTH_MASK = 0x7f
+
+
+class SegmentPacker:
+    def __init__(self, segment_size=SEGMENT_SIZE, max_latency=None, clock=time.monotonic):
+        if segment_size < 2:
+            raise ValueError("segment_size must leave room for a length byte")
+        self.segment_size = segment_size
+        self.max_latency = max_latency
+        self.clock = clock
+        self._segment = bytearray()
+        self._oldest = None  # arrival time of the first row in _segment
+
+        self.rows = 0
+        self.segments = 0
+        self.row_bytes = 0
+        self.segment_bytes = 0
+
+    def _emit(self):
+        segment = bytes(self._segment)
+        self._segment = bytearray()
+        self._oldest = None
+        self.segments += 1
+        self.segment_bytes += len(segment)
+        return segment
+
+    def due(self):
+        return (self._segment and self.max_latency is not None
+                and self.clock() - self._oldest >= self.max_latency)
+
+    def add(self, row):
+        """Queue a row; returns the segments that are ready to send."""
+        row = bytes(row)
+        if len(row) > LENGTH_MASK:
+            raise ValueError(f"row of {len(row)} bytes is too long to frame")
+        ready = []
+        if self.due():
+            ready.append(self._emit())
+        self.rows += 1
+        self.row_bytes += len(row)
+
+        # Start a fresh segment rather than split a row that fits in one
+        if len(self._segment) + 1 + len(row) > self.segment_size >= 1 + len(row):
+            ready.append(self._emit())
+        while True:
+            if self._oldest is None:
+                self._oldest = self.clock()
+            room = self.segment_size - len(self._segment) - 1
+            part, row = row[:room], row[room:]
+            self._segment.append(len(part) | (CONTINUES if row else 0))
+            self._segment += part
+            if len(self._segment) >= self.segment_size - 1:
+                ready.append(self._emit())
+            if not row:
+                return ready
+
+    def poll(self):
+        """The pending segment if it has waited max_latency, else None."""
+        return self._emit() if self.due() else None
+
+    def flush(self):
+        return [self._emit()] if self._segment else []
+
+    def pack(self, rows):
+        for row in rows:
+            yield from self.add(row)
+        yield from self.flush()
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "segments": self.segments,
+            "row_bytes": self.row_bytes,
+            "segment_bytes": self.segment_bytes,
+        }
+
+
+class SegmentUnpacker:
+    """Rows back out of segments, in message order."""
+
+    def __init__(self):
+        self._partial = None  # head of a row split across segments
+
+    def unpack(self, segment, follows_previous=True):
+        """follows_previous=False after a lost segment drops any split row."""
+        if not follows_previous:
+            self._partial = None
+        rows = []
+        pos = 0
+        while pos < len(segment):
+            header = segment[pos]
+            length = header & LENGTH_MASK
+            part = bytes(segment[pos + 1:pos + 1 + length])
+            pos += 1 + length
+            if self._partial is not None:
+                part = self._partial + part
+                self._partial = None
+            if header & CONTINUES:
+                self._partial = part
+            else:
+                rows.append(part)
+        return rows
@@ -0,0 +1,203 @@
+"""HCI command transports.
+
+Every transport exposes send_command(ogf, ocf, params) which sends one
+HCI command, waits for its Command Complete (or Command Status) event and
+returns the event's return parameters (status byte first). It raises
+HciError on a non-zero status and HciTimeout when no matching event
+arrives in time, so callers never need to sleep after a command.
+
+SocketTransport talks to the controller over a persistent raw
+AF_BLUETOOTH/BTPROTO_HCI socket, HcitoolTransport keeps the old
+`hcitool cmd` behaviour, and FakeController is an in-memory stand-in that
+needs neither a radio nor root.
+"""
+
+import re
+import socket
+import struct
+import subprocess
+import time
+
+from tagalong import metrics
+
+OGF_LE = 0x08
+OGF_VENDOR = 0x3f
+
+COMMAND_DISALLOWED = 0x0c
+
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+EVT_CMD_COMPLETE = 0x0e
+EVT_CMD_STATUS = 0x0f
+
+# Linux socket option values, in case Python was built without them
+SOL_HCI = getattr(socket, "SOL_HCI", 0)
+HCI_FILTER = getattr(socket, "HCI_FILTER", 2)
+
+
+class HciError(Exception):
+    def __init__(self, ogf, ocf, status):
+        super().__init__("HCI command 0x%02x/0x%04x failed with status 0x%02x" % (ogf, ocf, status))
+        self.ogf = ogf
+        self.ocf = ocf
+        self.status = status
+
+
+class HciTimeout(HciError):
+    def __init__(self, ogf, ocf, timeout):
+        Exception.__init__(self, "HCI command 0x%02x/0x%04x got no completion in %.1f s" % (ogf, ocf, timeout))
+        self.ogf = ogf
+        self.ocf = ocf
+        self.status = None
+
+
+def opcode(ogf, ocf):
+    return (ogf << 10) | ocf
+
+
+def dev_id(hci):
+    # "hci0" -> 0
+    return int(hci[3:]) if isinstance(hci, str) else int(hci)
+
+
+def command_packet(ogf, ocf, params=b""):
+    return struct.pack("<BHB", HCI_COMMAND_PKT, opcode(ogf, ocf), len(params)) + bytes(params)
+
+
+def parse_event(packet):
+    """Return (opcode, status, return_params) for Command Complete/Status, else None."""
+    if len(packet) < 3 or packet[0] != HCI_EVENT_PKT:
+        return None
+    event = packet[1]
+    if event == EVT_CMD_COMPLETE and len(packet) >= 6:
+        (op,) = struct.unpack_from("<H", packet, 4)
+        params = bytes(packet[6:])
+        return op, (params[0] if params else 0), params
+    if event == EVT_CMD_STATUS and len(packet) >= 7:
+        (op,) = struct.unpack_from("<H", packet, 5)
+        return op, packet[3], bytes(packet[3:4])
+    return None
+
+
+class _Transport:
+    """send_command() with per-adapter latency and error counters."""
+
+    def __init__(self, hci, timeout):
+        self.hci = hci
+        self.timeout = timeout
+        self._latency = metrics.HCI_COMMAND_SECONDS.labels(hci)
+        self._errors = metrics.HCI_ERRORS.labels(hci)
+
+    def send_command(self, ogf, ocf, params=b""):
+        start = time.perf_counter()
+        try:
+            return self._send_command(ogf, ocf, params)
+        except Exception:
+            self._errors.inc()
+            raise
+        finally:
+            self._latency.observe(time.perf_counter() - start)
+
+
+class SocketTransport(_Transport):
+    """Raw HCI socket, opened on first use (needs CAP_NET_RAW)."""
+
+    def __init__(self, hci="hci0", timeout=2.0):
+        super().__init__(hci, timeout)
+        self._sock = None
+
+    def _open(self):
+        sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW, socket.BTPROTO_HCI)
+        # Only let event packets for command completion through the filter
+        event_mask = (1 << EVT_CMD_COMPLETE) | (1 << EVT_CMD_STATUS)
+        sock.setsockopt(SOL_HCI, HCI_FILTER, struct.pack("<IIIH", 1 << HCI_EVENT_PKT, event_mask, 0, 0))
+        sock.bind((dev_id(self.hci),))
+        self._sock = sock
+
+    def _send_command(self, ogf, ocf, params):
+        if self._sock is None:
+            self._open()
+        op = opcode(ogf, ocf)
+        self._sock.send(command_packet(ogf, ocf, params))
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HciTimeout(ogf, ocf, self.timeout)
+            self._sock.settimeout(remaining)
+            try:
+                packet = self._sock.recv(260)
+            except socket.timeout:
+                raise HciTimeout(ogf, ocf, self.timeout) from None
+            reply = parse_event(packet)
+            if reply is None or reply[0] != op:
+                continue
+            _, status, ret = reply
+            if status:
+                raise HciError(ogf, ocf, status)
+            return ret
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class HcitoolTransport(_Transport):
+    """Spawns `hcitool -i <hci> cmd` per command, as the scripts used to."""
+
+    def __init__(self, hci="hci0", timeout=5.0):
+        super().__init__(hci, timeout)
+
+    def _send_command(self, ogf, ocf, params):
+        # hcitool itself blocks until the controller's event arrives
+        cmd = ["hcitool", "-i", self.hci, "cmd", "0x%02x" % ogf, "0x%04x" % ocf]
+        cmd += ["%02x" % b for b in params]
+        try:
+            out = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout).stdout
+        except subprocess.TimeoutExpired:
+            raise HciTimeout(ogf, ocf, self.timeout) from None
+        # "> HCI Event: 0x0e plen 4\n  01 0A 20 00"
+        m = re.search(r"> HCI Event: 0x([0-9a-f]{2}) plen \d+\s+((?:[0-9A-Fa-f]{2}\s*)+)", out)
+        if m is None:
+            return b""
+        packet = bytes([HCI_EVENT_PKT, int(m.group(1), 16), 0]) + bytes.fromhex(m.group(2))
+        reply = parse_event(packet)
+        if reply is not None and reply[1]:
+            raise HciError(ogf, ocf, reply[1])
+        return reply[2] if reply is not None else b""
+
+    def close(self):
+        pass
+
+
+class FakeController:
+    """In-memory controller that accepts every command and records it."""
+
+    def __init__(self, num_adv_sets=4):
+        self.commands = []  # (ogf, ocf, params)
+        self.fail = {}  # (ogf, ocf) -> status to return instead of success
+        self.num_adv_sets = num_adv_sets
+
+    def send_command(self, ogf, ocf, params=b""):
+        self.commands.append((ogf, ocf, bytes(params)))
+        status = self.fail.get((ogf, ocf), 0)
+        if status:
+            raise HciError(ogf, ocf, status)
+        return self.handle(ogf, ocf, bytes(params))
+
+    def handle(self, ogf, ocf, params):
+        # Return parameters after the status byte; subclasses model real state
+        if (ogf, ocf) == (OGF_LE, 0x003b):  # LE Read Number of Supported Advertising Sets
+            return bytes([0x00, self.num_adv_sets])
+        return b"\x00"
+
+    def close(self):
+        pass
+
+
+def open_transport(hci="hci0"):
+    """Raw socket transport where the platform has one, hcitool otherwise."""
+    if hasattr(socket, "AF_BLUETOOTH") and hasattr(socket, "BTPROTO_HCI"):
+        return SocketTransport(hci)
+    return HcitoolTransport(hci)
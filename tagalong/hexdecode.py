@@ -0,0 +1,86 @@
+"""Bulk hex decoding of the Data_1..Data_5 CSV columns.
+
+decode_hex_columns() replaces one hex_to_ascii call per cell: every
+column is viewed as a fixed-width uint8 matrix, pushed through a nibble
+lookup table and the decoded columns are packed row-major into one
+contiguous buffer with row offsets. Cells that are not valid hex (odd
+length, non-hex digits, bytes outside ASCII) mark their row invalid in a
+mask; invalid rows are left empty in the buffer rather than turned into
+"Error: ..." text that would get transmitted.
+"""
+
+import numpy as np
+
+_INVALID = 0xFF
+
+_NIBBLE = np.full(256, _INVALID, dtype=np.uint8)
+for _digit, _value in zip(b'0123456789abcdef', range(16)):
+    _NIBBLE[_digit] = _value
+    _NIBBLE[ord(chr(_digit).upper())] = _value
+
+
+class HexRows:
+    def __init__(self, buffer, offsets, valid, cell_valid):
+        self.buffer = buffer  # uint8, all valid rows back to back
+        self.offsets = offsets  # row i is buffer[offsets[i]:offsets[i + 1]]
+        self.valid = valid  # bool per row
+        self.cell_valid = cell_valid  # bool (rows, columns)
+
+    def __len__(self):
+        return len(self.valid)
+
+    def row(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def valid_rows(self):
+        return [self.row(i) for i in np.flatnonzero(self.valid)]
+
+    def invalid_indices(self):
+        return np.flatnonzero(~self.valid)
+
+
+def _decode_column(column):
+    """Decoded bytes and their row numbers for one column, plus a validity mask."""
+    # Surrounding whitespace is ignored, as by bytes.fromhex: a blank cell is empty
+    cells = [str(cell).strip() for cell in np.asarray(column, dtype=object).tolist()]
+    n = len(cells)
+    lengths = np.fromiter(map(len, cells), dtype=np.int64, count=n)
+    # One buffer for the whole column; unencodable characters become '?'
+    digits = np.frombuffer(''.join(cells).encode('ascii', errors='replace'), dtype=np.uint8)
+    nibbles = _NIBBLE[digits]
+
+    rows = np.arange(n)
+    cell_of_digit = np.repeat(rows, lengths)
+    valid = lengths % 2 == 0
+    valid &= np.bincount(cell_of_digit[nibbles == _INVALID], minlength=n) == 0
+
+    # Only even-length cells are left, so digit pairs line up with bytes
+    pairs = nibbles[np.repeat(valid, lengths)]
+    values = (pairs[0::2] << 4) | pairs[1::2]
+    value_rows = np.repeat(rows[valid], lengths[valid] // 2)
+    valid &= np.bincount(value_rows[values >= 0x80], minlength=n) == 0
+    return values, value_rows, valid
+
+
+def decode_hex_columns(columns):
+    """Decode hex columns and join each row's bytes in column order."""
+    decoded = [_decode_column(column) for column in columns]
+    if not decoded:
+        raise ValueError("need at least one column")
+    cell_valid = np.column_stack([valid for _, _, valid in decoded])
+    valid = cell_valid.all(axis=1)
+
+    # Bytes each cell contributes, zero for rows that are dropped
+    lengths = [np.bincount(r, minlength=len(valid)) * valid for _, r, _ in decoded]
+    offsets = np.zeros(len(valid) + 1, dtype=np.int64)
+    np.cumsum(sum(lengths), out=offsets[1:])
+
+    # Scatter each column straight to its place in the row-major buffer
+    buffer = np.empty(offsets[-1], dtype=np.uint8)
+    cell_start = offsets[:-1].copy()
+    for (values, rows, _), cell_len in zip(decoded, lengths):
+        kept = values[valid[rows]]
+        first = np.cumsum(cell_len) - cell_len
+        buffer[np.repeat(cell_start - first, cell_len) + np.arange(len(kept))] = kept
+        cell_start += cell_len
+    return HexRows(buffer, offsets, valid, cell_valid)
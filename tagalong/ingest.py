@@ -0,0 +1,235 @@
+"""Incremental CSV ingestion for sensor logs that only ever grow.
+
+CsvTail remembers a byte offset instead of the last timestamp, seeks
+straight to unread data and parses it in chunk_bytes slices, so a run
+costs O(new rows) and never holds more than one slice in memory. Only
+complete lines are consumed; a half-written last line is left for the
+next read. follow() keeps going and sleeps on inotify until the file
+grows (polling where inotify is unavailable).
+
+Each DataFrame is indexed by the byte offset where its row starts. When
+rows are sent out of order (a TransmitQueue sends the newest first),
+RowLedger turns the rows still outstanding into the offset that is safe
+to commit.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import io
+import os
+import select
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_CHUNK_BYTES = 1 << 20
+
+# inotify(7)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVE_SELF = 0x800
+IN_DELETE_SELF = 0x400
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class Inotify:
+    """Minimal ctypes inotify watch on one file."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVE_SELF | IN_DELETE_SELF
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed", path)
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(ready)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _row_starts(buf, start, rows):
+    # read_csv skips blank and whitespace-only lines
+    starts = []
+    pos = start
+    for line in buf.split(b'\n')[:-1]:
+        if line.strip():
+            starts.append(pos)
+        pos += len(line) + 1
+    if len(starts) != rows:
+        # Quoted newlines: attribute every row to the slice start, which
+        # never commits past a row that was not sent
+        starts = [start] * rows
+    return pd.Index(starts, name="offset")
+
+
+class CsvTail:
+    def __init__(self, path, offset_path=None, chunk_bytes=DEFAULT_CHUNK_BYTES, **read_csv_kwargs):
+        self.path = path
+        self.offset_path = offset_path
+        self.chunk_bytes = chunk_bytes
+        self.read_csv_kwargs = dict(read_csv_kwargs, header=None)
+        self.offset = self._load_offset()
+        self._committed = self.offset
+        self._inode = None
+        self.rows_read = 0
+        self.bytes_read = 0
+
+    def _load_offset(self):
+        if self.offset_path is None:
+            return 0
+        try:
+            with open(self.offset_path, 'r') as f:
+                offset, inode = f.read().split()
+            if os.stat(self.path).st_ino != int(inode):
+                return 0  # log was rotated since the last run
+            return int(offset)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def commit(self, offset=None):
+        """Persist offset, by default that of everything handed out so far."""
+        offset = self.offset if offset is None else offset
+        if self.offset_path is None or offset == self._committed:
+            return
+        tmp = self.offset_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(f"{offset} {os.stat(self.path).st_ino}\n")
+        os.replace(tmp, self.offset_path)
+        self._committed = offset
+
+    def seek_past(self, column, value):
+        """Start at the first row whose column exceeds value; returns the offset.
+
+        Migrates a deployment that bookmarked the last sent timestamp
+        instead of an offset. Rows must be in ascending order of column;
+        with no newer row the whole file counts as sent.
+        """
+        self.offset = 0
+        for frame in self.batches():
+            newer = frame.index[frame[column] > value]
+            if len(newer):
+                self.offset = int(newer[0])
+                break
+        self.rows_read = self.bytes_read = 0
+        self.commit()
+        return self.offset
+
+    def _check_rotation(self):
+        st = os.stat(self.path)
+        if self._inode is not None and st.st_ino != self._inode or st.st_size < self.offset:
+            self.offset = 0
+        self._inode = st.st_ino
+        return st.st_size
+
+    def batches(self):
+        """Yield a DataFrame per slice of complete, unread lines."""
+        size = self._check_rotation()
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                buf = f.read(self.chunk_bytes)
+                if not buf:
+                    return
+                end = buf.rfind(b'\n') + 1
+                if not end:
+                    # One line longer than a slice: finish it if it is complete
+                    rest = f.readline()
+                    if not rest.endswith(b'\n'):
+                        return
+                    buf += rest
+                    end = len(buf)
+                elif end < len(buf):
+                    f.seek(end - len(buf), os.SEEK_CUR)
+                start = self.offset
+                self.offset += end
+                self.bytes_read += end
+                try:
+                    frame = pd.read_csv(io.BytesIO(buf[:end]), **self.read_csv_kwargs)
+                except pd.errors.EmptyDataError:
+                    continue  # blank lines only
+                frame.index = _row_starts(buf[:end], start, len(frame))
+                self.rows_read += len(frame)
+                yield frame
+
+    def follow(self, poll=1.0, stop=None):
+        """batches(), forever: block until the file grows, then read again."""
+        try:
+            watch = Inotify(self.path)
+        except (OSError, AttributeError, TypeError):
+            watch = None
+        try:
+            while stop is None or not stop.is_set():
+                yield from self.batches()
+                if watch is not None:
+                    watch.wait(poll)
+                else:
+                    time.sleep(poll)
+        finally:
+            if watch is not None:
+                watch.close()
+
+    def stats(self):
+        return {
+            "offset": self.offset,
+            "rows_read": self.rows_read,
+            "bytes_read": self.bytes_read,
+        }
+
+
+class RowLedger:
+    """Commit point for rows that are sent, or dropped, in any order.
+
+    track() the start offset of every row handed to the sender, then
+    mark(end) once the slice is tracked; done(start) once a row went out.
+    committable() is the start of the oldest row still outstanding, or the
+    end of the last slice when none are.
+    """
+
+    def __init__(self, tail):
+        self.tail = tail
+        self._pending = collections.Counter()  # start offset -> rows outstanding
+        self._read_to = tail.offset
+        self._lock = threading.Lock()
+
+    def track(self, start):
+        with self._lock:
+            self._pending[start] += 1
+
+    def mark(self, end):
+        with self._lock:
+            self._read_to = end
+
+    def done(self, start):
+        with self._lock:
+            self._pending[start] -= 1
+            if not self._pending[start]:
+                del self._pending[start]
+
+    def committable(self):
+        with self._lock:
+            return min(self._pending) if self._pending else self._read_to
+
+    def outstanding(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def commit(self):
+        self.tail.commit(self.committable())
@@ -0,0 +1,132 @@
+"""Persistent cache of key template -> valid counter.
+
+The template is the 28 byte key with the counter bytes zeroed, so it
+already covers modem_id, msg_id and the 16 byte body. Entries live in a
+small SQLite file and the least recently used ones are evicted once the
+cache grows past max_entries.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from tagalong import keysearch, metrics
+
+_HITS = metrics.KEY_CACHE_LOOKUPS.labels("hit")
+_MISSES = metrics.KEY_CACHE_LOOKUPS.labels("miss")
+
+DEFAULT_PATH = os.path.expanduser("~/.cache/tagalong/key_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 200000
+
+
+def key_template(public_key):
+    template = bytearray(public_key)
+    template[keysearch.COUNTER_SLICE] = b'\x00\x00'
+    return bytes(template)
+
+
+class KeyCache:
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        path = DEFAULT_PATH if path is None else path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.search_seconds = 0.0  # time spent searching on misses
+
+        # The key-generation stage of a TransmitPipeline runs on its own thread
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS keys ("
+            " template BLOB PRIMARY KEY,"
+            " counter INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS keys_last_used ON keys(last_used)")
+        self._size, tick = self._db.execute(
+            "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM keys").fetchone()
+        self._tick = tick
+
+    def _next_tick(self):
+        self._tick += 1
+        return self._tick
+
+    def lookup(self, public_key):
+        """Return the final key for public_key's template, or None on a miss.
+
+        On a hit the counter is also written into public_key[6:8].
+        """
+        with self._lock:
+            return self._lookup(public_key)
+
+    def _lookup(self, public_key):
+        template = key_template(public_key)
+        row = self._db.execute(
+            "SELECT counter FROM keys WHERE template = ?", (template,)).fetchone()
+        if row is None:
+            self.misses += 1
+            _MISSES.inc()
+            return None
+        self.hits += 1
+        _HITS.inc()
+        self._db.execute(
+            "UPDATE keys SET last_used = ? WHERE template = ?", (self._next_tick(), template))
+        public_key[keysearch.COUNTER_SLICE] = row[0].to_bytes(2, 'big')
+        return public_key
+
+    def store(self, public_key, counter, search_seconds=0.0):
+        with self._lock:
+            self._store(public_key, counter, search_seconds)
+
+    def _store(self, public_key, counter, search_seconds):
+        template = key_template(public_key)
+        self.search_seconds += search_seconds
+        metrics.record_search(counter, search_seconds)
+        tick = self._next_tick()
+        cur = self._db.execute(
+            "INSERT OR IGNORE INTO keys (template, counter, last_used) VALUES (?, ?, ?)",
+            (template, counter, tick))
+        if cur.rowcount == 0:
+            self._db.execute(
+                "UPDATE keys SET counter = ?, last_used = ? WHERE template = ?",
+                (counter, tick, template))
+            return
+        self._size += 1
+        if self._size > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        self._db.execute(
+            "DELETE FROM keys WHERE template IN"
+            " (SELECT template FROM keys ORDER BY last_used LIMIT ?)", (excess,))
+        self._size = self.max_entries
+
+    def find_valid_counter(self, public_key):
+        # Cached counterpart of keysearch.find_valid_counter
+        if self.lookup(public_key) is not None:
+            return int.from_bytes(public_key[keysearch.COUNTER_SLICE], 'big')
+        start = time.perf_counter()
+        counter = keysearch.find_valid_counter(public_key)
+        self.store(public_key, counter, time.perf_counter() - start)
+        return counter
+
+    def stats(self):
+        avg_search = self.search_seconds / self.misses if self.misses else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": self._size,
+            "search_seconds": self.search_seconds,
+            "saved_seconds_estimate": self.hits * avg_search,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
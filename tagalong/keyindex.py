@@ -0,0 +1,188 @@
+"""Precomputed candidate hashed IDs for a modem and a msg_id range.
+
+Every fetch of a message rebuilds the same candidate keys (counter search
+plus SHA-256) for its first positions, and polling a message that has not
+arrived yet repeats that work on every poll. build_index() does it once,
+on a process pool, and writes a file that KeyIndex memory-maps:
+
+    header      modem, chunk_len, depth, msg_id range
+    digests     SHA-256 of every candidate key, in generation order
+    sorted      first 8 digest bytes of every record, ascending
+    order       record number for each entry of sorted
+
+A candidate depends on the chunks before it (the XOR chain), so the index
+enumerates every prefix up to `depth` positions: 2^chunk_len candidates
+for position 0, 2^(2 chunk_len) for position 1, and so on. Records are
+generated in (msg_id, position, prefix, value) order, so the candidates
+for a known prefix are a contiguous slice found by arithmetic, and mapping
+a reported hashed ID back to (msg_id, position, value) is a binary search
+over `sorted`.
+"""
+
+import argparse
+import base64
+import hashlib
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+
+from tagalong import fetch
+from tagalong.schedule import BODY_LEN, place_chunk
+
+MAGIC = b'TAKI'
+VERSION = 1
+HEADER = struct.Struct('<4sHBBIIIQ')  # magic, version, chunk_len, depth, modem, first msg_id, msg count, records
+HEADER_SIZE = 32
+DIGEST_SIZE = 32
+MAX_PREFIX_BITS = 24  # 2^24 candidates per message is already hours of key search
+
+
+def _level_offsets(chunk_len, depth):
+    # Record offset of each position's first candidate within one message
+    offsets = [0]
+    for position in range(depth):
+        offsets.append(offsets[-1] + (1 << (chunk_len * (position + 1))))
+    return offsets
+
+
+def prefix_body(prefix, position, chunk_len):
+    """Body after the first `position` chunks, given as one LSB-first integer."""
+    body = bytearray(BODY_LEN)
+    mask = (1 << chunk_len) - 1
+    for i in range(position):
+        place_chunk(body, i, (prefix >> (i * chunk_len)) & mask, chunk_len)
+    return body
+
+
+def _message_digests(args):
+    modem, msg_id, chunk_len, depth = args
+    out = bytearray()
+    for position in range(depth):
+        for prefix in range(1 << (chunk_len * position)):
+            body = prefix_body(prefix, position, chunk_len)
+            for key in fetch.candidate_keys(modem, msg_id, body, position, chunk_len).values():
+                out += hashlib.sha256(bytes(key)).digest()
+    return bytes(out)
+
+
+def build_index(path, modem, first_msg_id, count, chunk_len, depth=1, processes=None):
+    """Write the index for msg_ids first_msg_id .. first_msg_id + count - 1; returns the record count."""
+    if not 1 <= chunk_len <= 8:
+        raise ValueError("chunk_len must be between 1 and 8")
+    if depth < 1 or chunk_len * (depth - 1) > MAX_PREFIX_BITS:
+        raise ValueError(f"depth must be at least 1 and cover at most {MAX_PREFIX_BITS} prefix bits")
+    per_message = _level_offsets(chunk_len, depth)[-1]
+    records = per_message * count
+    tmp = f"{path}.{os.getpid()}.tmp"
+    work = [(modem, first_msg_id + i, chunk_len, depth) for i in range(count)]
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, chunk_len, depth, modem, first_msg_id, count, records)
+                .ljust(HEADER_SIZE, b'\0'))
+        with multiprocessing.Pool(processes) as pool:
+            for digests in pool.imap(_message_digests, work):
+                f.write(digests)
+
+    digests = np.memmap(tmp, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(records, DIGEST_SIZE))
+    keys = digests[:, :8].copy().view('>u8').ravel().astype('<u8')
+    del digests
+    order = np.argsort(keys, kind="stable").astype('<u4')
+    with open(tmp, "ab") as f:
+        f.write(keys[order].tobytes())
+        f.write(order.tobytes())
+    os.replace(tmp, path)
+    return records
+
+
+class KeyIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        magic, version, self.chunk_len, self.depth, self.modem, self.first_msg_id, self.count, records = \
+            HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} key index")
+        self.path = path
+        self.records = records
+        self._offsets = _level_offsets(self.chunk_len, self.depth)
+        self._per_message = self._offsets[-1]
+        start = HEADER_SIZE
+        self._digests = np.memmap(path, dtype=np.uint8, mode="r", offset=start, shape=(records, DIGEST_SIZE))
+        start += records * DIGEST_SIZE
+        self._sorted = np.memmap(path, dtype='<u8', mode="r", offset=start, shape=(records,))
+        start += records * 8
+        self._order = np.memmap(path, dtype='<u4', mode="r", offset=start, shape=(records,))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.records
+
+    def _record(self, record):
+        message, rest = divmod(record, self._per_message)
+        position = next(p for p in range(self.depth) if rest < self._offsets[p + 1])
+        prefix, value = divmod(rest - self._offsets[position], 1 << self.chunk_len)
+        return self.first_msg_id + message, position, value
+
+    def locate(self, hashed_id):
+        """(msg_id, position, value) for a base64 hashed ID or raw digest, or None."""
+        digest = base64.b64decode(hashed_id) if isinstance(hashed_id, str) else bytes(hashed_id)
+        key = int.from_bytes(digest[:8], 'big')
+        i = int(np.searchsorted(self._sorted, key))
+        while i < self.records and self._sorted[i] == key:
+            record = int(self._order[i])
+            if self._digests[record].tobytes() == digest:
+                return self._record(record)
+            i += 1
+        return None
+
+    def _prefix(self, modem, msg_id, body, position, chunk_len):
+        # Index records assume a zero start body, so the body is the prefix
+        if modem != self.modem or chunk_len != self.chunk_len or position >= self.depth:
+            return None
+        if not 0 <= msg_id - self.first_msg_id < self.count:
+            return None
+        prefix = int.from_bytes(body, 'big')
+        return prefix if prefix >> (chunk_len * position) == 0 else None
+
+    def candidate_ids(self, modem, msg_id, body, position, chunk_len, values=None):
+        """FetchDecoder candidates hook: from the index when covered, computed otherwise."""
+        prefix = self._prefix(modem, msg_id, body, position, chunk_len)
+        if prefix is None:
+            self.misses += 1
+            return fetch.candidate_ids(modem, msg_id, body, position, chunk_len, values)
+        self.hits += 1
+        first = ((msg_id - self.first_msg_id) * self._per_message + self._offsets[position]
+                 + (prefix << chunk_len))
+        values = values if values is not None else range(1 << chunk_len)
+        return {value: base64.b64encode(self._digests[first + value].tobytes()).decode() for value in values}
+
+    def close(self):
+        # np.memmap unmaps once the last reference is gone
+        self._digests = self._sorted = self._order = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a candidate hashed-ID index")
+    parser.add_argument("path")
+    parser.add_argument("--modem", type=lambda s: int(s, 0), required=True)
+    parser.add_argument("--first", type=int, default=0, help="first msg_id")
+    parser.add_argument("--count", type=int, required=True, help="number of msg_ids")
+    parser.add_argument("--chunk-len", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=1, help="positions to enumerate")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+    records = build_index(args.path, args.modem, args.first, args.count, args.chunk_len, args.depth,
+                          args.processes)
+    print(f"Wrote {records} records to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
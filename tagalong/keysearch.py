@@ -0,0 +1,65 @@
+"""Validity check for the compressed P-224 keys used as TagAlong advertisements.
+
+A 28 byte key is usable when it is the x coordinate of a point on P-224,
+i.e. when x^3 - 3x + b is a quadratic residue mod p. Deciding that only
+needs the Jacobi symbol on plain ints, so the search loop never builds an
+ecdsa VerifyingKey (which decompresses the point and multiplies it by the
+group order on every try).
+"""
+
+# NIST P-224 domain parameters
+P = 0xffffffffffffffffffffffffffffffff000000000000000000000001
+B = 0xb4050a850c04b3abf54132565044b0b7d7bfd8ba270b39432355ffb4
+
+COUNTER_SLICE = slice(6, 8)  # valid_key_counter lives in key[6:8]
+MAX_COUNTER = 0xFFFF
+
+
+def jacobi(a, n):
+    # Binary Jacobi symbol; about 3x cheaper than Euler's criterion
+    # pow(a, (n - 1) // 2, n) for 224 bit operands.
+    result = 1
+    a %= n
+    while a:
+        twos = (a & -a).bit_length() - 1
+        a >>= twos
+        if twos & 1 and n & 7 in (3, 5):
+            result = -result
+        if a & n & 3 == 3:
+            result = -result
+        a, n = n % a, a
+    return result if n == 1 else 0
+
+
+def is_valid_x(x):
+    # Same acceptance rule as VerifyingKey.from_string(b"\x02" + key, NIST224p)
+    if x >= P:
+        return False
+    alpha = (x * x * x - 3 * x + B) % P
+    return jacobi(alpha, P) != -1
+
+
+def is_valid_key(public_key):
+    return is_valid_x(int.from_bytes(public_key, 'big'))
+
+
+def is_valid_pubkey(public_key, valid_key_counter=0):
+    # Writes the counter into the key like the script versions do
+    public_key[COUNTER_SLICE] = valid_key_counter.to_bytes(2, 'big')
+    return is_valid_key(public_key)
+
+
+def find_valid_counter(public_key, start=0):
+    """Return the first counter >= start that makes public_key valid.
+
+    The counter is left in public_key[6:8] on return.
+    """
+    # The counter only moves bytes 6..7, so add it to the integer directly
+    # instead of re-serialising the key on every try.
+    shift = 8 * (len(public_key) - COUNTER_SLICE.stop)
+    base = int.from_bytes(public_key, 'big') & ~(MAX_COUNTER << shift)
+    for counter in range(start, MAX_COUNTER + 1):
+        if is_valid_x(base | (counter << shift)):
+            public_key[COUNTER_SLICE] = counter.to_bytes(2, 'big')
+            return counter
+    raise ValueError("no valid counter for key %s" % public_key.hex())
@@ -0,0 +1,223 @@
+"""Process-wide counters for where a transmit cycle's time goes.
+
+Instruments are attribute updates under a per-instrument lock (the
+pipeline, ingest and fan-out threads update them concurrently) with no
+I/O, so leaving them in hot paths costs next to nothing; the rest is paid
+only when an Exporter renders them, by default every 15 seconds. The Prometheus text
+file is meant for node_exporter's textfile collector, the JSON snapshot
+for everything else.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    # (family suffix, TYPE, sample suffixes) as rendered in the text format
+    families = ()
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self
+        self._init_child()
+        registry.register(self)
+
+    def _init_child(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        pass
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = object.__new__(type(self))
+                    child._init_child()
+                    self._children[values] = child
+        return child
+
+    def _samples(self):
+        """(suffix, labels, value) for every child."""
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            with child._lock:
+                child_values = child._values()
+            for suffix, value in child_values:
+                yield suffix, labels, value
+
+
+class Counter(_Metric):
+    families = (("_total", "counter", ("_total",)),)
+
+    def _reset(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _values(self):
+        return [("_total", self.value)]
+
+
+class Gauge(_Metric):
+    families = (("", "gauge", ("",)),)
+
+    def _reset(self):
+        self.value = 0
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def _values(self):
+        return [("", self.value)]
+
+
+class Summary(_Metric):
+    """Count, sum and max of observations (no quantiles); max is its own gauge."""
+    families = (("", "summary", ("_count", "_sum")), ("_max", "gauge", ("_max",)))
+
+    def _reset(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def _values(self):
+        return [("_count", self.count), ("_sum", self.sum), ("_max", self.max)]
+
+
+KEY_SEARCHES = Counter("tagalong_key_searches", "Counter searches completed")
+KEY_SEARCH_ITERATIONS = Counter("tagalong_key_search_iterations", "Counter values tried by key searches")
+KEY_SEARCH_SECONDS = Summary("tagalong_key_search_seconds", "Wall time per key search")
+KEY_CACHE_LOOKUPS = Counter("tagalong_key_cache_lookups", "Key cache lookups", ("result",))
+HCI_COMMAND_SECONDS = Summary("tagalong_hci_command_seconds", "HCI command round trip", ("hci",))
+HCI_ERRORS = Counter("tagalong_hci_errors", "HCI commands that failed or timed out", ("hci",))
+DWELL_SECONDS = Counter("tagalong_dwell_seconds", "Time keys were held on air")
+SLEEP_SECONDS = Counter("tagalong_sleep_seconds", "Time spent in fixed waits other than dwell")
+KEYS_ADVERTISED = Counter("tagalong_keys_advertised", "Keys put on air")
+QUEUE_DEPTH = Gauge("tagalong_queue_depth", "Items waiting in a transmit queue", ("queue",))
+
+
+def record_search(counter, seconds):
+    """A counter search that started at 0 and ended on `counter`."""
+    KEY_SEARCHES.inc()
+    KEY_SEARCH_ITERATIONS.inc(counter + 1)
+    KEY_SEARCH_SECONDS.observe(seconds)
+
+
+def sleep(seconds):
+    """time.sleep() that is accounted as SLEEP_SECONDS."""
+    time.sleep(seconds)
+    SLEEP_SECONDS.inc(seconds)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = ('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels.items())
+    return "{" + ",".join(parts) + "}"
+
+
+def render(registry=REGISTRY):
+    """The registry in Prometheus text exposition format."""
+    lines = []
+    for metric in registry.metrics:
+        samples = list(metric._samples())
+        # Metadata goes under the family name the samples actually carry
+        # (e.g. foo_total for a counter), as prometheus_client writes it
+        for family, kind, suffixes in metric.families:
+            name = metric.name + family
+            help = f"{metric.help} (maximum)" if family == "_max" else metric.help
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                if suffix in suffixes:
+                    lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(registry=REGISTRY):
+    """{sample name: value}, or {sample name: {label values: value}} for labelled metrics."""
+    out = {}
+    for metric in registry.metrics:
+        for suffix, labels, value in metric._samples():
+            name = metric.name + suffix
+            if labels:
+                out.setdefault(name, {})[",".join(labels.values())] = value
+            else:
+                out[name] = value
+    return out
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)  # scrapers never see a half-written file
+
+
+class Exporter:
+    """Periodically writes the registry as a .prom text file and/or JSON."""
+
+    def __init__(self, prom_path=None, json_path=None, interval=15.0, registry=REGISTRY):
+        self.prom_path = prom_path
+        self.json_path = json_path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def to_directory(cls, directory, job, interval=15.0):
+        """<directory>/<job>.prom and <job>.json, or None if directory is None."""
+        if directory is None:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f"{job}.prom"), os.path.join(directory, f"{job}.json"), interval)
+
+    def write(self):
+        if self.prom_path is not None:
+            _write_atomic(self.prom_path, render(self.registry))
+        if self.json_path is not None:
+            _write_atomic(self.json_path, json.dumps({"time": time.time(), "metrics": snapshot(self.registry)}, indent=1))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
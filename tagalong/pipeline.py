@@ -0,0 +1,95 @@
+"""Two-stage transmitter: key generation runs ahead of the radio.
+
+A producer thread pulls keys from an iterable (where the counter search
+happens) into a bounded queue while the calling thread advertises them.
+The radio stage picks up the next key as soon as the previous dwell
+ends, so a full cycle costs max(crypto, dwell) rather than the sum.
+"""
+
+import queue
+import threading
+import time
+
+from tagalong import metrics
+
+DEFAULT_LOOKAHEAD = 4
+
+_DONE = object()
+_DEPTH = metrics.QUEUE_DEPTH.labels("pipeline")
+
+
+class TransmitPipeline:
+    def __init__(self, advertise, lookahead=DEFAULT_LOOKAHEAD):
+        if lookahead < 1:
+            raise ValueError("lookahead must be at least 1")
+        self.advertise = advertise
+        self.lookahead = lookahead
+        self._queue = queue.Queue(maxsize=lookahead)
+        self._error = None
+        self._stop = threading.Event()
+
+        self.keys_sent = 0
+        self.radio_wait_seconds = 0.0  # radio idle, waiting for a key
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _produce(self, keys):
+        try:
+            for key in keys:
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(key, timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+                if self._stop.is_set():
+                    return
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._queue.put(_DONE)
+
+    def run(self, keys):
+        """Advertise every key from keys, in order; returns stats()."""
+        producer = threading.Thread(target=self._produce, args=(keys,), name="keygen", daemon=True)
+        producer.start()
+        try:
+            while True:
+                depth = self._queue.qsize()
+                self.depth_samples += 1
+                self.depth_total += depth
+                self.max_depth = max(self.max_depth, depth)
+                _DEPTH.set(depth)
+
+                wait_start = time.perf_counter()
+                key = self._queue.get()
+                self.radio_wait_seconds += time.perf_counter() - wait_start
+                if key is _DONE:
+                    break
+                self.advertise(key)
+                self.keys_sent += 1
+        finally:
+            self._stop.set()
+            # Unblock a producer stuck on a full queue
+            while producer.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    producer.join(0.1)
+        if self._error is not None:
+            raise self._error
+        return self.stats()
+
+    def stats(self):
+        return {
+            "keys_sent": self.keys_sent,
+            "lookahead": self.lookahead,
+            "queue_depth": self.depth(),
+            "mean_queue_depth": self.depth_total / self.depth_samples if self.depth_samples else 0.0,
+            "max_queue_depth": self.max_depth,
+            "radio_wait_seconds": self.radio_wait_seconds,
+        }
@@ -0,0 +1,114 @@
+"""--profile for the sender scripts.
+
+    sudo python3 send_csv_data.py --profile /tmp/send_csv_data
+
+runs main() once under cProfile (<prefix>.pstats, for pstats/snakeviz)
+while a sampling thread records every thread's stack each `interval`
+seconds into <prefix>.collapsed, one "frame;frame;... count" line per
+distinct stack, ready for flamegraph.pl or speedscope. Each sampled stack
+is rooted at a tag naming the stage it is in (pandas ingestion, chunk
+planning, key search, advertisement building, HCI I/O, waits), so
+profiles from different firmware versions can be compared stage by stage.
+"""
+
+import cProfile
+import collections
+import os
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.005
+
+# First match from the innermost frame outwards wins
+STACK_TAGS = [
+    ("hci", lambda path, func: func in ("send_command", "_send_command", "restart_bluetoothd")
+        or path.endswith(os.path.join("tagalong", "hci.py")) or os.sep + "subprocess.py" in path),
+    ("advertisement", lambda path, func: func in ("advertisement_data", "advertising_address", "adv_params",
+                                                  "ext_adv_params", "start_advertising")),
+    ("key_search", lambda path, func: func in ("is_valid_pubkey", "is_valid_key", "find_valid_counter",
+                                               "resolve", "_search")),
+    ("chunk_planning", lambda path, func: func in ("plan_chunks", "chunk_values", "key_templates",
+                                                   "send_data_once_blocking", "set_addr_and_payload_for_byte")),
+    ("pandas", lambda path, func: os.sep + "pandas" + os.sep in path or func in ("batches", "read_csv")),
+    # Dwell and fixed delays: the innermost Python frame is the one calling time.sleep
+    ("wait", lambda path, func: func == "sleep" or (path.endswith("advertiser.py") and func == "start")),
+]
+
+
+def tag_stack(frames):
+    """frames: (path, function) innermost first."""
+    for path, func in frames:
+        for tag, matches in STACK_TAGS:
+            if matches(path, func):
+                return tag
+    return "other"
+
+
+class StackSampler:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.tags = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            tag = tag_stack(frames)
+            labels = [f"{os.path.basename(path)}:{func}" for path, func in reversed(frames)]
+            self.stacks[";".join([f"[{tag}]", names.get(ident, str(ident))] + labels)] += 1
+            self.tags[tag] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile(fn, prefix, *args, interval=DEFAULT_INTERVAL):
+    """Run fn(*args) under cProfile plus the stack sampler; returns fn's result."""
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        profiler.dump_stats(prefix + ".pstats")
+        sampler.write_collapsed(prefix + ".collapsed")
+        total = sum(sampler.tags.values()) or 1
+        shares = ", ".join(f"{tag} {100 * n / total:.0f}%" for tag, n in sampler.tags.most_common())
+        print(f"Profile: {elapsed:.2f} s, wrote {prefix}.pstats and {prefix}.collapsed ({shares})")
+
+
+def run_main(main, argv):
+    """main(argv), or under profile() if argv has --profile PREFIX."""
+    if "--profile" not in argv:
+        return main(argv)
+    i = argv.index("--profile")
+    if i + 1 >= len(argv):
+        sys.exit("--profile needs an output prefix")
+    prefix = argv[i + 1]
+    return profile(main, prefix, argv[:i] + argv[i + 2:])
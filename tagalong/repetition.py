@@ -0,0 +1,138 @@
+"""Per-position repeat counts from past fetch results.
+
+The fetch side recovers a message chunk by chunk, and some positions get
+lost much more often than others. RepetitionController estimates, per
+chunk position, the probability q that a single advertisement of a key
+gets reported, and picks the smallest repeat count that reaches the
+target delivery rate:
+
+    repeats = ceil(log(1 - target) / log(1 - q))
+
+clamped to [min_repeats, max_repeats]. A position that would need more
+than max_repeats gets a proportionally longer dwell instead (up to
+max_dwell, twice dwell by default).
+
+Fetch results are a CSV of msg_id,chunk,recovered[,repeats] rows
+(recovered is 0/1, repeats is how often the key was sent, default
+default_repeats); lines starting with # are ignored. load_fetch_log()
+reads the DataFetcher log format instead (from_file(..., format="log")).
+"""
+
+import csv
+import math
+import re
+
+DEFAULT_TARGET = 0.95
+FORMATS = ("csv", "log")
+PRIOR_WEIGHT = 4.0  # observations the all-positions rate is worth per position
+
+_RESULT = re.compile(r"Result: Message (\d+) (?:(No Report Found)|.*bytestring: \[([\d, ]*)\])")
+
+
+def load_fetch_log(path):
+    """(msg_id, chunk, recovered) from a DataFetcher log.
+
+    DataFetcher logs a Result line after every chunk it fetches, so each
+    message is counted once, from its last state: the n bytes recovered
+    are delivered positions 0..n-1, and if the message then hit "No
+    Report Found", position n is lost.
+    """
+    state = {}  # msg_id -> [bytes recovered, ended on a lost chunk]
+    with open(path) as f:
+        for line in f:
+            match = _RESULT.search(line)
+            if not match:
+                continue
+            entry = state.setdefault(int(match.group(1)), [0, False])
+            if match.group(2):
+                entry[1] = True
+            else:
+                recovered = [b for b in match.group(3).split(',') if b.strip()]
+                entry[0] = max(entry[0], len(recovered))
+                entry[1] = False
+    results = []
+    for msg_id, (recovered, lost) in state.items():
+        results.extend((msg_id, chunk, True) for chunk in range(recovered))
+        if lost:
+            results.append((msg_id, recovered, False))
+    return results
+
+
+class RepetitionController:
+    def __init__(self, target=DEFAULT_TARGET, default_repeats=5, min_repeats=1, max_repeats=20,
+                 dwell=1.0, max_dwell=None, prior_weight=PRIOR_WEIGHT):
+        if not 0 < target < 1:
+            raise ValueError("target must be between 0 and 1")
+        self.target = target
+        self.default_repeats = default_repeats
+        self.min_repeats = min_repeats
+        self.max_repeats = max_repeats
+        self.dwell = dwell
+        self.max_dwell = max_dwell if max_dwell is not None else 2 * dwell
+        self.prior_weight = prior_weight
+        self.sent = {}  # chunk -> keys observed
+        self.delivered = {}  # chunk -> keys recovered
+        self.advertised = {}  # chunk -> total repeats of the observed keys
+
+    @classmethod
+    def from_file(cls, path, format="csv", **kwargs):
+        """Fetch results from a CSV (format="csv") or a DataFetcher log (format="log")."""
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        controller = cls(**kwargs)
+        if format == "log":
+            for msg_id, chunk, recovered in load_fetch_log(path):
+                controller.record(msg_id, chunk, recovered)
+            return controller
+        with open(path, newline='') as f:
+            for row in csv.reader(line for line in f if not line.startswith('#')):
+                if not row:
+                    continue
+                repeats = int(row[3]) if len(row) > 3 and row[3] else None
+                controller.record(int(row[0]), int(row[1]), row[2].strip() not in ('0', '', 'False'), repeats)
+        return controller
+
+    def record(self, msg_id, chunk, recovered, repeats=None):
+        """One fetch outcome for a key that was advertised `repeats` times."""
+        self.sent[chunk] = self.sent.get(chunk, 0) + 1
+        self.delivered[chunk] = self.delivered.get(chunk, 0) + bool(recovered)
+        self.advertised[chunk] = self.advertised.get(chunk, 0) + (repeats or self.default_repeats)
+
+    def _key_rate(self, chunk):
+        """Smoothed probability that a key at this position was recovered."""
+        total_sent = sum(self.sent.values())
+        overall = (sum(self.delivered.values()) + 1) / (total_sent + 2)
+        sent = self.sent.get(chunk, 0)
+        return (self.delivered.get(chunk, 0) + self.prior_weight * overall) / (sent + self.prior_weight)
+
+    def delivery(self, chunk):
+        """Estimated probability that one advertisement of a key at chunk is reported."""
+        if not self.sent:
+            return None
+        if chunk in self.sent:
+            repeats = self.advertised[chunk] / self.sent[chunk]
+        else:
+            repeats = sum(self.advertised.values()) / sum(self.sent.values())
+        # A key sent r times is lost only if all r advertisements are
+        key_rate = min(self._key_rate(chunk), 1 - 1e-9)
+        return 1 - (1 - key_rate) ** (1 / repeats)
+
+    def repeats_needed(self, chunk):
+        q = self.delivery(chunk)
+        if q is None:
+            return self.default_repeats
+        if q <= 0:
+            return math.inf
+        return max(1, math.ceil(math.log(1 - self.target) / math.log(1 - q)))
+
+    def plan(self, chunk):
+        """(repeats, dwell) for the key at this chunk position."""
+        needed = self.repeats_needed(chunk)
+        repeats = min(max(needed, self.min_repeats), self.max_repeats)
+        dwell = self.dwell
+        if needed > self.max_repeats:
+            dwell = min(self.dwell * needed / self.max_repeats, self.max_dwell)
+        return repeats, dwell
+
+    def stats(self):
+        return {chunk: self.plan(chunk) for chunk in sorted(self.sent)}
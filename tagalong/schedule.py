@@ -0,0 +1,132 @@
+"""Key schedule for one message: every chunk's advertised key, in order.
+
+Chunk keys depend on each other only through the cumulative XOR body
+(curr_addr in the scripts), which is cheap to compute. The counter
+search for each key is independent once its template is known, so
+KeyScheduleBuilder computes all templates first and can hand the searches
+to a process pool. A search is typically well under a millisecond, so
+the pool only pays off for large batches on several cores; it is off by
+default and benchmarks/key_schedule.py finds the break-even min_parallel.
+"""
+
+import multiprocessing
+import time
+
+from tagalong import keysearch, metrics
+from tagalong.chunking import plan_chunks
+
+MAGIC = b'\xBA\xBE'
+BODY_LEN = 16
+SEGMENT_SIZE = 16
+
+
+def modem_bytes(modem_id):
+    # Same byte order as copy_4b_big_endian() in the scripts
+    return modem_id.to_bytes(4, byteorder='big')
+
+
+def place_chunk(body, index, val, chunk_len):
+    """XOR chunk val into the 16 byte body at chunk position index."""
+    bit_index = index * chunk_len
+    start_byte = (bit_index // 8) % BODY_LEN
+    next_byte = (start_byte + 1) % BODY_LEN
+    start_offset = bit_index % 8
+
+    body[BODY_LEN - 1 - start_byte] ^= (val << start_offset) & 0xFF
+    if (8 - start_offset) < chunk_len:
+        body[BODY_LEN - 1 - next_byte] ^= val >> (8 - start_offset)
+
+
+def key_template(modem, msg_id, body):
+    public_key = bytearray(28)
+    public_key[0:2] = MAGIC
+    public_key[2:6] = modem
+    public_key[8:12] = msg_id.to_bytes(4, byteorder='big')
+    public_key[12:28] = body
+    return public_key
+
+
+def key_templates(modem, msg_id, data, chunk_len, start_body=bytes(BODY_LEN)):
+    """Counter-less keys for every chunk of data, in transmit order."""
+    plan = plan_chunks(data, chunk_len, start_body)
+    return [key_template(modem, msg_id, body.tobytes()) for body in plan.bodies]
+
+
+def _search(template):
+    public_key = bytearray(template)
+    keysearch.find_valid_counter(public_key)
+    return bytes(public_key)
+
+
+class KeyScheduleBuilder:
+    """Builds message key schedules, optionally on a process pool.
+
+    Batches of at least min_parallel searches go to the pool, which is
+    started on first use; with min_parallel=None everything is searched
+    in-process. Keys already in cache (a KeyCache)
+    are not searched again, and newly found ones are added to it.
+    """
+
+    def __init__(self, processes=None, cache=None, min_parallel=None):
+        self.processes = processes
+        self.cache = cache
+        self.min_parallel = min_parallel  # below this, a pool round trip costs more than it saves
+        self._pool = None
+
+    def _map(self, templates):
+        if self.min_parallel is None or len(templates) < self.min_parallel or self.processes == 1:
+            return [_search(t) for t in templates]
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        chunksize = max(1, len(templates) // (4 * (self.processes or multiprocessing.cpu_count())))
+        return self._pool.map(_search, templates, chunksize)
+
+    def resolve(self, templates):
+        """Return the final key for each template, preserving order."""
+        keys = [None] * len(templates)
+        pending = []
+        for i, template in enumerate(templates):
+            if self.cache is not None and self.cache.lookup(template) is not None:
+                keys[i] = template
+            else:
+                pending.append(i)
+
+        start = time.perf_counter()
+        found = self._map([bytes(templates[i]) for i in pending])
+        # Searches run side by side; each is charged an equal share of the batch
+        share = (time.perf_counter() - start) / len(pending) if pending else 0.0
+        for i, key in zip(pending, found):
+            keys[i] = bytearray(key)
+            counter = int.from_bytes(key[keysearch.COUNTER_SLICE], 'big')
+            if self.cache is not None:
+                self.cache.store(keys[i], counter, share)
+            else:
+                metrics.record_search(counter, share)
+        return keys
+
+    def build(self, modem, msg_id, data, chunk_len):
+        """Ordered keys for a single segment (up to 16 bytes) of data."""
+        return self.resolve(key_templates(modem, msg_id, data, chunk_len))
+
+    def build_segments(self, modem, msg_id, data, chunk_len, segment_size=SEGMENT_SIZE):
+        """Ordered keys per segment; segment i is sent as msg_id + i."""
+        templates = []
+        bounds = []
+        for seg_index, start in enumerate(range(0, len(data), segment_size)):
+            segment = key_templates(modem, msg_id + seg_index, data[start:start + segment_size], chunk_len)
+            bounds.append((len(templates), len(templates) + len(segment)))
+            templates += segment
+        keys = self.resolve(templates)
+        return [keys[lo:hi] for lo, hi in bounds]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,113 @@
+"""asyncio transmit scheduler.
+
+Jobs are (key, dwell, repeats, deadline) and are advertised in the order
+they were submitted. HCI commands run on a single worker thread and the
+dwell is an asyncio sleep, so the event loop stays free for CSV
+ingestion and key search while a key is on air.
+"""
+
+import asyncio
+import concurrent.futures
+import time
+
+from tagalong import metrics
+
+_DEPTH = metrics.QUEUE_DEPTH.labels("scheduler")
+
+
+class TransmitJob:
+    def __init__(self, key, dwell=1.0, repeats=1, deadline=None, interval_ms=20):
+        self.key = bytes(key)
+        self.dwell = dwell
+        self.repeats = repeats
+        self.deadline = deadline  # time.monotonic() after which remaining repeats are dropped
+        self.interval_ms = interval_ms
+
+    def expired(self, now=None):
+        return self.deadline is not None and (time.monotonic() if now is None else now) >= self.deadline
+
+
+class AsyncScheduler:
+    """Runs TransmitJobs through start(key, interval_ms), e.g. Advertiser.load.
+
+    start must not dwell itself; the scheduler owns the dwell. maxsize bounds how many jobs may wait, so producers that
+    await put() are held back when the radio falls behind.
+    """
+
+    def __init__(self, start, maxsize=0, sleep=asyncio.sleep):
+        self.start = start
+        self.sleep = sleep
+        self._queue = asyncio.Queue(maxsize)
+        # One thread keeps HCI commands ordered without blocking the loop
+        self._hci = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="hci")
+        self._closed = False
+
+        self.keys_sent = 0
+        self.repeats_sent = 0
+        self.repeats_expired = 0
+        self.jobs_expired = 0
+
+    async def put(self, job):
+        if self._closed:
+            raise RuntimeError("scheduler is closed")
+        await self._queue.put(job)
+
+    def submit(self, job):
+        """Enqueue without waiting; raises asyncio.QueueFull when bounded and full."""
+        if self._closed:
+            raise RuntimeError("scheduler is closed")
+        self._queue.put_nowait(job)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    async def search(self, fn, *args, executor=None):
+        """Run a blocking key search off the loop (default executor unless given)."""
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def _send(self, job):
+        loop = asyncio.get_running_loop()
+        sent_any = False
+        for _ in range(job.repeats):
+            if job.expired():
+                self.repeats_expired += 1
+                continue
+            await loop.run_in_executor(self._hci, self.start, job.key, job.interval_ms)
+            self.repeats_sent += 1
+            sent_any = True
+            await self.sleep(job.dwell)
+            metrics.DWELL_SECONDS.inc(job.dwell)
+        if sent_any:
+            self.keys_sent += 1
+        else:
+            self.jobs_expired += 1
+
+    async def run(self):
+        """Advertise jobs until close() has been called and the queue is drained."""
+        try:
+            while True:
+                job = await self._queue.get()
+                _DEPTH.set(self._queue.qsize())
+                try:
+                    if job is None:
+                        return self.stats()
+                    await self._send(job)
+                finally:
+                    self._queue.task_done()
+        finally:
+            self._hci.shutdown(wait=False)
+
+    async def close(self):
+        """Stop accepting jobs; run() returns once everything queued is sent."""
+        if not self._closed:
+            self._closed = True
+            await self._queue.put(None)
+
+    def stats(self):
+        return {
+            "keys_sent": self.keys_sent,
+            "repeats_sent": self.repeats_sent,
+            "repeats_expired": self.repeats_expired,
+            "jobs_expired": self.jobs_expired,
+            "pending": self.pending(),
+        }
@@ -0,0 +1,183 @@
+"""Compact binary records for CSV rows.
+
+A Schema lists the columns of a row with their wire type, so "23.71"
+goes out as a 2 byte fixed-point int16 instead of 5 bytes of text:
+
+    schema = Schema([DeltaTime('Timestamp'), Fixed16('Data_2', decimals=2)])
+    records = schema.encoder().pack_rows(df)
+
+Fields are packed big-endian in declaration order. A schema with DeltaTime
+fields puts a header byte in front of each record: bit 7 marks a keyframe,
+bits 0-6 are a sequence number. Keyframes carry absolute uint32 times,
+other records a uint16 delta to the previous record; the decoder drops
+records after a sequence gap until the next keyframe so a lost row never
+shifts the times that follow it.
+
+Records routinely contain 0x00 bytes (the high byte of a small delta or
+value), which end a message on the fetch side; send them through
+cobs.encode and fetch with FetchDecoder(stuffed=True).
+"""
+
+import struct
+
+DEFAULT_KEYFRAME_EVERY = 16
+
+KEYFRAME = 0x80
+SEQ_MASK = 0x7f
+
+
+class Field:
+    fmt = None
+
+    def __init__(self, name, decimals=0):
+        self.name = name
+        self.decimals = decimals
+        self.scale = 10 ** decimals
+        self._struct = struct.Struct('>' + self.fmt)
+        self.size = self._struct.size
+
+    def encode(self, value):
+        raw = round(float(value) * self.scale)
+        try:
+            return self._struct.pack(raw)
+        except struct.error:
+            raise ValueError(f"{self.name}={value!r} does not fit {type(self).__name__}") from None
+
+    def decode(self, data):
+        raw = self._struct.unpack(data)[0]
+        return raw / self.scale if self.decimals else raw
+
+
+class Fixed16(Field):
+    """Signed fixed point: value * 10**decimals as int16."""
+    fmt = 'h'
+
+
+class UInt8(Field):
+    """Unsigned fixed point: value * 10**decimals as uint8."""
+    fmt = 'B'
+
+
+class DeltaTime:
+    """Integer timestamp: uint32 on keyframes, uint16 delta otherwise."""
+
+    def __init__(self, name, resolution=1):
+        self.name = name
+        self.resolution = resolution
+
+    def ticks(self, value):
+        return int(value) // self.resolution
+
+
+class Schema:
+    def __init__(self, fields, keyframe_every=DEFAULT_KEYFRAME_EVERY):
+        if not fields:
+            raise ValueError("schema needs at least one field")
+        self.fields = list(fields)
+        self.keyframe_every = keyframe_every
+        self.times = [f for f in self.fields if isinstance(f, DeltaTime)]
+
+    def record_size(self, keyframe=True):
+        size = 1 if self.times else 0
+        for field in self.fields:
+            if isinstance(field, DeltaTime):
+                size += 4 if keyframe else 2
+            else:
+                size += field.size
+        return size
+
+    def encoder(self):
+        return SchemaEncoder(self)
+
+    def decoder(self):
+        return SchemaDecoder(self)
+
+
+class SchemaEncoder:
+    def __init__(self, schema):
+        self.schema = schema
+        self.seq = 0
+        self.last = {}  # DeltaTime name -> ticks of the previous record
+
+    def _deltas(self, row):
+        deltas = {}
+        for field in self.schema.times:
+            ticks = field.ticks(row[field.name])
+            if field.name not in self.last:
+                return None
+            delta = ticks - self.last[field.name]
+            if not 0 <= delta <= 0xffff:
+                return None
+            deltas[field.name] = delta
+        return deltas
+
+    def pack(self, row):
+        """row: mapping of column name to value."""
+        schema = self.schema
+        out = bytearray()
+        if schema.times:
+            deltas = None
+            if self.seq % schema.keyframe_every:
+                deltas = self._deltas(row)
+            keyframe = deltas is None
+            out.append((KEYFRAME if keyframe else 0) | (self.seq & SEQ_MASK))
+            for field in schema.times:
+                self.last[field.name] = field.ticks(row[field.name])
+        for field in schema.fields:
+            if isinstance(field, DeltaTime):
+                if keyframe:
+                    out += struct.pack('>I', self.last[field.name] & 0xffffffff)
+                else:
+                    out += struct.pack('>H', deltas[field.name])
+            else:
+                out += field.encode(row[field.name])
+        self.seq += 1
+        return bytes(out)
+
+    def pack_rows(self, frame):
+        names = [field.name for field in self.schema.fields]
+        return [self.pack(row) for row in frame[names].to_dict('records')]
+
+
+class SchemaDecoder:
+    def __init__(self, schema):
+        self.schema = schema
+        self.seq = None
+        self.last = {}
+        self.dropped = 0
+
+    def unpack(self, record):
+        """The row as a dict, or None while waiting for a keyframe."""
+        schema = self.schema
+        pos = 0
+        keyframe = True
+        if schema.times:
+            header = record[0]
+            pos = 1
+            keyframe = bool(header & KEYFRAME)
+            seq = header & SEQ_MASK
+            in_sequence = self.seq is not None and seq == (self.seq + 1) & SEQ_MASK
+            self.seq = seq
+            if not keyframe and not in_sequence:
+                self.last = {}
+            if not keyframe and not self.last:
+                self.dropped += 1
+                return None
+        if len(record) != schema.record_size(keyframe):
+            raise ValueError(f"record is {len(record)} bytes, expected {schema.record_size(keyframe)}")
+
+        row = {}
+        for field in schema.fields:
+            if isinstance(field, DeltaTime):
+                if keyframe:
+                    ticks = struct.unpack_from('>I', record, pos)[0]
+                    pos += 4
+                else:
+                    ticks = self.last[field.name] + struct.unpack_from('>H', record, pos)[0]
+                    pos += 2
+                self.last[field.name] = ticks
+                row[field.name] = ticks * field.resolution
+            else:
+                row[field.name] = field.decode(record[pos:pos + field.size])
+                pos += field.size
+        return row
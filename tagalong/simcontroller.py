@@ -0,0 +1,144 @@
+"""Simulated HCI controller on a virtual clock.
+
+SimulatedController models the commands the TagAlong senders use (vendor
+BD address, LE random address, legacy and extended advertising), rejects
+an LE random address change while legacy advertising is on as a real
+controller does, and records every key that went on air, with virtual start and end times.
+Command latency and the bluetoothd restart are charged to a SimClock
+instead of real time, so a full transmit run finishes in the time its
+Python code takes.
+"""
+
+import shlex
+
+from tagalong.hci import COMMAND_DISALLOWED, OGF_LE, OGF_VENDOR, FakeController, HciError
+
+
+class SimClock:
+    """Virtual time, split by what it was spent on."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.spent = {}
+
+    def advance(self, seconds, kind="sleep"):
+        if seconds > 0:
+            self.now += seconds
+            self.spent[kind] = self.spent.get(kind, 0.0) + seconds
+
+    def sleep(self, seconds):
+        self.advance(seconds, "sleep")
+
+    def time(self):
+        return self.now
+
+
+def key_from_advertisement(address, adv):
+    """Recover the 28 byte key from an advertising address and payload."""
+    key = bytearray(28)
+    key[0] = (address[0] & 0x3f) | (adv[29] << 6)
+    key[1:6] = address[1:6]
+    key[6:28] = adv[7:29]
+    return bytes(key)
+
+
+class SimulatedController(FakeController):
+    LEGACY = "legacy"  # on_air slot of the legacy advertiser; extended sets use their handle
+
+    def __init__(self, clock=None, command_latency=0.0005, restart_seconds=2.0, num_adv_sets=4):
+        super().__init__(num_adv_sets)
+        self.clock = clock if clock is not None else SimClock()
+        self.command_latency = command_latency
+        self.restart_seconds = restart_seconds
+
+        self.public_address = bytes(6)
+        self._pending_public = None  # vendor address, applied on restart
+        self.random_address = bytes(6)
+        self.own_addr_type = 0
+        self.adv_data = bytes(31)
+        self.sets = {}  # handle -> {"address": ..., "data": ...}
+
+        self.on_air = {}  # slot -> (start, address, data)
+        self.advertised = []  # (start, end, key)
+
+    def send_command(self, ogf, ocf, params=b""):
+        self.clock.advance(self.command_latency, "hci")
+        return super().send_command(ogf, ocf, params)
+
+    def restart(self):
+        # systemctl restart bluetooth: the vendor address takes effect and
+        # the controller comes back with advertising off
+        self.clock.advance(self.restart_seconds, "restart")
+        self._off(self.LEGACY)
+        if self._pending_public is not None:
+            self.public_address = self._pending_public
+            self._pending_public = None
+
+    def run_hcitool(self, argv):
+        """Handle an `hcitool -i hciX cmd ogf ocf bytes...` argv."""
+        args = list(argv)
+        i = args.index("cmd")
+        ogf, ocf = int(args[i + 1], 16), int(args[i + 2], 16)
+        return self.send_command(ogf, ocf, bytes(int(b, 16) for b in args[i + 3:]))
+
+    def run(self, argv, **kwargs):
+        # Drop-in for subprocess.run in scripts that shell out
+        if isinstance(argv, str):
+            argv = shlex.split(argv)
+        if argv[0] == "hcitool":
+            self.run_hcitool(argv)
+        elif argv[:2] == ["systemctl", "restart"]:
+            self.restart()
+
+    def _on(self, slot, address, data):
+        self._off(slot)
+        self.on_air[slot] = (self.clock.now, bytes(address), bytes(data))
+
+    def _off(self, slot):
+        if slot in self.on_air:
+            start, address, data = self.on_air.pop(slot)
+            self.advertised.append((start, self.clock.now, key_from_advertisement(address, data)))
+
+    def _legacy_address(self):
+        return self.random_address if self.own_addr_type == 1 else self.public_address
+
+    def handle(self, ogf, ocf, params):
+        if (ogf, ocf) == (OGF_VENDOR, 0x001):
+            self._pending_public = params[::-1]
+        elif ogf != OGF_LE:
+            pass
+        elif ocf == 0x0005:
+            if self.LEGACY in self.on_air:
+                raise HciError(ogf, ocf, COMMAND_DISALLOWED)
+            self.random_address = params[::-1]
+        elif ocf == 0x0006:
+            self.own_addr_type = params[5]
+        elif ocf == 0x0008:
+            self.adv_data = params[1:1 + params[0]]
+            if self.LEGACY in self.on_air:
+                self._on(self.LEGACY, self._legacy_address(), self.adv_data)
+        elif ocf == 0x000a:
+            if params[0]:
+                self._on(self.LEGACY, self._legacy_address(), self.adv_data)
+            else:
+                self._off(self.LEGACY)
+        elif ocf == 0x0035:
+            self.sets.setdefault(params[0], {"data": bytes(31)})["address"] = params[1:7][::-1]
+        elif ocf == 0x0036:
+            self.sets.setdefault(params[0], {"address": bytes(6), "data": bytes(31)})
+        elif ocf == 0x0037:
+            self.sets.setdefault(params[0], {"address": bytes(6)})["data"] = params[4:4 + params[3]]
+        elif ocf == 0x0039:
+            handles = [params[2 + 4 * i] for i in range(params[1])] or list(self.sets)
+            for handle in handles:
+                if params[0]:
+                    self._on(handle, self.sets[handle]["address"], self.sets[handle]["data"])
+                else:
+                    self._off(handle)
+        return super().handle(ogf, ocf, params)
+
+    def finish(self):
+        """Take everything off air at the current time and return the log."""
+        for slot in list(self.on_air):
+            self._off(slot)
+        return self.advertised
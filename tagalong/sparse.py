@@ -0,0 +1,127 @@
+"""Sparse row updates: send only the bytes that changed.
+
+Consecutive sensor rows often differ in a byte or two, yet each one costs
+a key per byte. SparseEncoder sends a row as a delta against the previous
+row it sent for that modem, falling back to the full row (a keyframe)
+every keyframe_every rows, when the length changes or when the delta
+would not be smaller.
+
+    keyframe: [0x80 | version] row...
+    delta:    [version] [base version] bitmap... changed bytes...
+
+Versions count modulo 128. The bitmap has one bit per row byte, LSB
+first; the changed bytes follow in position order. SparseDecoder keeps
+the recent versions it has rebuilt and returns None for a delta whose
+base it never saw, until the next keyframe.
+
+Version, base version and bitmap bytes are 0x00 all the time (the first
+delta's base is version 0, an unchanged group of 8 bytes has a zero
+bitmap byte), so payloads go out through cobs.encode and are fetched
+with FetchDecoder(stuffed=True).
+"""
+
+DEFAULT_KEYFRAME_EVERY = 16
+
+KEYFRAME = 0x80
+VERSION_MASK = 0x7f
+HISTORY = 8  # versions the decoder keeps as possible bases
+
+
+def _bitmap_len(row_len):
+    return (row_len + 7) // 8
+
+
+def delta_payload(version, base_version, base, row):
+    bitmap = bytearray(_bitmap_len(len(row)))
+    changed = bytearray()
+    for pos, (old, new) in enumerate(zip(base, row)):
+        if old != new:
+            bitmap[pos // 8] |= 1 << (pos % 8)
+            changed.append(new)
+    return bytes([version, base_version]) + bytes(bitmap) + bytes(changed)
+
+
+class SparseEncoder:
+    def __init__(self, keyframe_every=DEFAULT_KEYFRAME_EVERY):
+        self.keyframe_every = keyframe_every
+        self.version = 0
+        self.sent = 0
+        self.base = None  # last row sent
+        self.keyframes = 0
+        self.row_bytes = 0
+        self.payload_bytes = 0
+
+    def encode(self, row):
+        row = bytes(row)
+        version = self.version & VERSION_MASK
+        payload = None
+        if self.base is not None and len(self.base) == len(row) and self.sent % self.keyframe_every:
+            payload = delta_payload(version, (self.version - 1) & VERSION_MASK, self.base, row)
+            if len(payload) > len(row):
+                payload = None
+        if payload is None:
+            payload = bytes([KEYFRAME | version]) + row
+            self.keyframes += 1
+
+        self.base = row
+        self.version += 1
+        self.sent += 1
+        self.row_bytes += len(row)
+        self.payload_bytes += len(payload)
+        return payload
+
+    def stats(self):
+        return {
+            "rows": self.sent,
+            "keyframes": self.keyframes,
+            "row_bytes": self.row_bytes,
+            "payload_bytes": self.payload_bytes,
+        }
+
+
+class SparseDecoder:
+    def __init__(self):
+        self.rows = {}  # version -> rebuilt row, most recent HISTORY only
+        self.order = []
+        self.missing_base = 0
+
+    def _keep(self, version, row):
+        if version in self.rows:
+            self.order.remove(version)
+        self.rows[version] = row
+        self.order.append(version)
+        while len(self.order) > HISTORY:
+            del self.rows[self.order.pop(0)]
+
+    def decode(self, payload):
+        """The full row, or None if the delta's base is unknown.
+
+        Raises ValueError for a payload cut short, e.g. by a lost message.
+        """
+        if not payload or not payload[0] & KEYFRAME and len(payload) < 2:
+            raise ValueError("truncated sparse row")
+        header = payload[0]
+        version = header & VERSION_MASK
+        if header & KEYFRAME:
+            row = bytes(payload[1:])
+            self._keep(version, row)
+            return row
+
+        base = self.rows.get(payload[1])
+        if base is None:
+            self.missing_base += 1
+            return None
+        bitmap_len = _bitmap_len(len(base))
+        bitmap = payload[2:2 + bitmap_len]
+        changed = payload[2 + bitmap_len:]
+        if len(bitmap) < bitmap_len:
+            raise ValueError("truncated sparse row")
+        positions = [pos for pos in range(len(base)) if bitmap[pos // 8] >> (pos % 8) & 1]
+        if len(changed) < len(positions):
+            raise ValueError("truncated sparse row")
+        row = bytearray(base)
+        for pos, value in zip(positions, changed):
+            row[pos] = value
+        row = bytes(row)
+        self._keep(version, row)
+        return row
@@ -0,0 +1,156 @@
+"""Bounded priority queue between row ingestion and the radio.
+
+When rows arrive faster than they can be advertised, sending them in
+arrival order means every row is sent later than the one before it, and
+memory grows without bound. TransmitQueue holds at most maxsize rows,
+hands out the highest priority first (alarms above readings) and, within
+a priority, the newest first by default, so fresh data waits at most one
+queue's worth of airtime. When it is full it evicts from the lowest
+priority according to policy:
+
+    drop-oldest  drop the oldest row
+    downsample   drop every other row, oldest first, keeping time coverage
+    coalesce     a row replaces the queued row with the same key (e.g. the
+                 sensor it came from); otherwise drop-oldest
+
+on_drop(row, reason) is called for every row that is dropped instead of
+sent, so the caller can decide what happens to it (e.g. keep it unsent
+in the ingest offset).
+"""
+
+import collections
+import threading
+import time
+
+from tagalong import metrics
+
+DROP_OLDEST = "drop-oldest"
+DOWNSAMPLE = "downsample"
+COALESCE = "coalesce"
+POLICIES = (DROP_OLDEST, DOWNSAMPLE, COALESCE)
+
+DEFAULT_MAXSIZE = 64
+
+_DEPTH = metrics.QUEUE_DEPTH.labels("transmit")
+
+
+class _Entry:
+    __slots__ = ("row", "key", "queued_at")
+
+    def __init__(self, row, key, queued_at):
+        self.row = row
+        self.key = key
+        self.queued_at = queued_at
+
+
+class TransmitQueue:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, policy=DROP_OLDEST, newest_first=True, clock=time.monotonic,
+                 on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.newest_first = newest_first
+        self.clock = clock
+        self.on_drop = on_drop
+        self._levels = {}  # priority -> deque of _Entry, oldest on the left
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = collections.Counter()  # reason -> rows
+        self.age_total = 0.0
+        self.max_age = 0.0
+
+    def __len__(self):
+        return self._size
+
+    def _lowest(self):
+        return min(p for p, level in self._levels.items() if level)
+
+    def _drop(self, row, reason):
+        self.dropped[reason] += 1
+        if self.on_drop is not None:
+            self.on_drop(row, reason)
+
+    def _remove(self, priority, entry, reason):
+        self._levels[priority].remove(entry)
+        self._size -= 1
+        self._drop(entry.row, reason)
+
+    def _evict(self):
+        priority = self._lowest()
+        level = self._levels[priority]
+        if self.policy == DOWNSAMPLE and len(level) > 1:
+            for entry in list(level)[::2]:
+                self._remove(priority, entry, DOWNSAMPLE)
+        else:
+            self._remove(priority, level[0], DROP_OLDEST)
+
+    def put(self, row, priority=0, key=None):
+        """Queue a row; returns False if it was dropped straight away."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("queue is closed")
+            self.enqueued += 1
+            level = self._levels.setdefault(priority, collections.deque())
+            if self.policy == COALESCE and key is not None:
+                for entry in level:
+                    if entry.key == key:
+                        self._remove(priority, entry, COALESCE)
+                        break
+            if self._size >= self.maxsize:
+                if priority < self._lowest():
+                    self._drop(row, DROP_OLDEST)
+                    return False
+                self._evict()
+            level.append(_Entry(row, key, self.clock()))
+            self._size += 1
+            _DEPTH.set(self._size)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Next row to send; None once closed and drained (or on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._size or self._closed, timeout):
+                return None
+            if not self._size:
+                return None
+            level = self._levels[max(p for p, level in self._levels.items() if level)]
+            entry = level.pop() if self.newest_first else level.popleft()
+            self._size -= 1
+            _DEPTH.set(self._size)
+            age = self.clock() - entry.queued_at
+            self.sent += 1
+            self.age_total += age
+            self.max_age = max(self.max_age, age)
+            return entry.row
+
+    def __iter__(self):
+        return iter(self.get, None)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def oldest_age(self):
+        with self._cond:
+            queued = [level[0].queued_at for level in self._levels.values() if level]
+        return self.clock() - min(queued) if queued else 0.0
+
+    def stats(self):
+        return {
+            "queued": self._size,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": dict(self.dropped),
+            "mean_age": self.age_total / self.sent if self.sent else 0.0,
+            "max_age": self.max_age,
+            "oldest_age": self.oldest_age(),
+        }